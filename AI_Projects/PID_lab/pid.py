@@ -1,11 +1,13 @@
 class PIDcontroller:
-    def __init__(self):
-        self.p_p = 0.02
-        self.p_i = 0.00005
-        self.p_d = 0.5
-        self.CTE_list = [0]
+    def __init__(self, p_p=0.02, p_i=0.00005, p_d=0.5):
+        self.p_p = p_p
+        self.p_i = p_i
+        self.p_d = p_d
+        self.prev_CTE = 0.0
+        self.CTE_sum = 0.0  # running integral of the CTE
 
     def process(self, CTE):
-        self.CTE_list.append(CTE)
-        return -self.p_p * CTE - self.p_d * (self.CTE_list[-1]-self.CTE_list[-2]) - self.p_i * sum(self.CTE_list)
-
+        self.CTE_sum += CTE
+        derivative = CTE - self.prev_CTE
+        self.prev_CTE = CTE
+        return -self.p_p * CTE - self.p_d * derivative - self.p_i * self.CTE_sum
@@ -0,0 +1,342 @@
+"""Headless PID car simulation.
+
+The car kinematics (steering, wind, steer bias) and the tracking metrics of
+main.py, without pygame. `run` simulates one controller frame by frame,
+`simulate` runs many gain sets at once with NumPy. main.py draws the same
+simulation in a pygame window.
+"""
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+import pid
+
+# ================== CONFIG ==================
+FrameHeight = 400
+FrameWidth = 1200
+FPS = 60               # nominal frame rate, used to convert frames to seconds
+
+TARGET_Y = 266         # CTE = y - TARGET_Y
+START_POS = (45, 200)
+START_ANGLE = 220
+MAX_VEL = 1
+ROTATION_VEL = 4
+WIND = 0.2             # upward drift per frame
+STEER_BIAS = 0.3       # added to every steering command
+
+# ===== Metrics configuration (for CV) =====
+EPS_CTE = 5.0          # settling band in pixels
+SETTLE_FRAMES = 45     # ~0.75 s at 60 FPS
+
+
+def out_of_bounds(x, y):
+    return (x > FrameWidth) | (x < 0) | (y < 0) | (y > FrameHeight)
+
+
+class Car:
+    """Kinematics of the car, shared by the headless simulation and the pygame viewer."""
+
+    def __init__(self, max_vel=MAX_VEL, rotation_vel=ROTATION_VEL, start_pos=START_POS, wind=True):
+        self.start_pos = start_pos
+        self.max_vel = max_vel
+        self.vel = 0
+        self.rotation_vel = rotation_vel
+        self.max_steering_angle = 4.0
+        self.steering_angle = 0.0
+        self.angle = START_ANGLE
+        self.x, self.y = start_pos
+        self.prev_x, self.prev_y = start_pos
+        self.acceleration = 0.1
+        self.wind = wind
+
+    def rotate(self):
+        if self.steering_angle > self.max_steering_angle:
+            self.steering_angle = self.max_steering_angle
+        if self.steering_angle < -self.max_steering_angle:
+            self.steering_angle = -self.max_steering_angle
+
+        # steering proportional to velocity
+        self.angle -= (self.vel / self.max_vel) * self.steering_angle
+
+    def move_forward(self):
+        self.vel = min(self.vel + self.acceleration, self.max_vel)
+        self.move()
+
+    def move_backward(self):
+        self.vel = max(self.vel - self.acceleration, -self.max_vel / 2)
+        self.move()
+
+    def reduce_speed(self):
+        self.vel = max(self.vel - self.acceleration / 2, 0)
+        self.move()
+
+    def bounce(self):
+        self.vel = -self.vel
+        self.move()
+
+    def move(self):
+        radians = math.radians(self.angle)
+        vertical = math.cos(radians) * self.vel
+        horizontal = math.sin(radians) * self.vel
+
+        self.prev_x = self.x
+        self.prev_y = self.y
+        self.y -= vertical
+        self.x -= horizontal
+
+        if self.wind:
+            self.y -= WIND
+
+    def reset(self):
+        self.x, self.y = self.start_pos
+        self.angle = 0
+        self.vel = 0
+
+
+class Metrics:
+    """Aggregate tracking metrics, updated once per frame."""
+
+    def __init__(self):
+        self.frames = 0
+        self.t_start = time.perf_counter()
+        self.cte_abs_sum = 0.0      # for mean|CTE|
+        self.cte_sq_sum = 0.0       # for RMSE
+        self.cte_max_abs = 0.0
+        self.cte_last = None
+        self.zero_crossings = 0     # optional, not printed in final summary
+        self.settled = False
+        self.settle_frame = None
+        self.settle_window = deque(maxlen=SETTLE_FRAMES)
+        self.u_abs_sum = 0.0        # mean|u|
+        self.u_sq_sum = 0.0         # mean(u^2)
+        self.fps_sum = 0.0
+        self.frame_time_sum = 0.0   # seconds
+        self.oob = 0
+
+    def update_metrics(self, current_cte: float, control_u: float, fps_now: float = FPS):
+        """Update aggregate metrics once per frame."""
+        # counts & timing
+        self.frames += 1
+        self.fps_sum += fps_now
+        self.frame_time_sum += 1.0 / max(fps_now, 1e-6)
+
+        # error stats
+        abs_cte = abs(current_cte)
+        self.cte_abs_sum += abs_cte
+        self.cte_sq_sum += current_cte * current_cte
+        if abs_cte > self.cte_max_abs:
+            self.cte_max_abs = abs_cte
+
+        # zero crossings (optional)
+        if self.cte_last is not None and (self.cte_last * current_cte) < 0:
+            self.zero_crossings += 1
+        self.cte_last = current_cte
+
+        # settling detection (|CTE| within band for consecutive frames)
+        self.settle_window.append(abs_cte <= EPS_CTE)
+        if (not self.settled
+                and len(self.settle_window) == SETTLE_FRAMES
+                and all(self.settle_window)):
+            self.settled = True
+            self.settle_frame = self.frames
+
+        # control effort
+        self.u_abs_sum += abs(control_u)
+        self.u_sq_sum += control_u * control_u
+
+    def summary(self):
+        """Summary statistics as a dict, settle_time is None if the car never settled."""
+        n = max(self.frames, 1)
+        avg_fps = self.fps_sum / n
+        if self.settled and self.settle_frame is not None and avg_fps > 0:
+            settle_time = self.settle_frame / avg_fps
+        else:
+            settle_time = None
+        return {
+            "duration": time.perf_counter() - self.t_start,
+            "frames": n,
+            "rmse": (self.cte_sq_sum / n) ** 0.5,
+            "mean_abs_cte": self.cte_abs_sum / n,
+            "max_abs_cte": self.cte_max_abs,
+            "settle_time": settle_time,
+            "mean_abs_u": self.u_abs_sum / n,
+            "mean_sq_u": self.u_sq_sum / n,
+            "avg_fps": avg_fps,
+            "avg_frame_ms": 1000.0 * (self.frame_time_sum / n),
+            "zero_crossings": self.zero_crossings,
+            "oob": self.oob,
+        }
+
+    def final_report(self):
+        """Print a compact summary suitable for the CV/README."""
+        s = self.summary()
+        print("\n=== PID Tracking Report ===")
+        print(f"Duration: {s['duration']:.2f}s  Frames: {s['frames']}")
+        print(f"RMSE(CTE): {s['rmse']:.2f} px   Mean|CTE|: {s['mean_abs_cte']:.2f} px   Max|CTE|: {s['max_abs_cte']:.1f} px")
+        if s["settle_time"] is not None:
+            print(f"Settling time (|CTE|≤{EPS_CTE} px for {SETTLE_FRAMES} frames): {s['settle_time']:.2f} s")
+        else:
+            print("Settling time: not settled")
+        print(f"Control effort: mean|u|={s['mean_abs_u']:.3f}   mean(u^2)={s['mean_sq_u']:.3f}")
+        print(f"Performance: avg FPS={s['avg_fps']:.1f}   avg frame={s['avg_frame_ms']:.2f} ms")
+        print(f"Out-of-bounds exits: {s['oob']}")
+
+
+def steer(car, controller, metrics, steer_bias=True, fps_now=FPS):
+    """Set the steering angle of the car with the controller and update the metrics."""
+    current_CTE = car.y - TARGET_Y
+    car.steering_angle = controller.process(current_CTE)
+    if steer_bias:
+        car.steering_angle += STEER_BIAS
+    car.rotate()
+    metrics.update_metrics(current_CTE, car.steering_angle, fps_now)
+
+
+def step(car, controller, metrics, steer_bias=True, fps_now=FPS):
+    """Advance one frame: steer with the controller, update the metrics and drive forward."""
+    steer(car, controller, metrics, steer_bias, fps_now)
+    car.move_forward()
+
+
+def run(controller=None, max_frames=100000, wind=True, steer_bias=True):
+    """Simulate one controller until the car leaves the frame or max_frames have passed.
+
+    Runs as fast as possible, every frame counts as 1/FPS seconds. Returns the Metrics.
+    """
+    controller = controller if controller is not None else pid.PIDcontroller()
+    car = Car(wind=wind)
+    metrics = Metrics()
+    for _ in range(max_frames):
+        step(car, controller, metrics, steer_bias)
+        if out_of_bounds(car.x, car.y):
+            metrics.oob += 1
+            break
+    return metrics
+
+
+def simulate(gains, max_frames=100000, wind=True, steer_bias=True):
+    """Simulate many PID gain sets at once, one car per gain set.
+
+    gains is an array of shape (n, 3) with the (p_p, p_i, p_d) gains of each car. Every car runs
+    the same frames as `run`, until it leaves the frame or max_frames have passed. Returns a dict
+    of arrays with the same statistics as Metrics.summary (without the wall-clock entries),
+    settle_time is nan for cars that never settled.
+    """
+    gains = np.atleast_2d(np.asarray(gains, dtype=float))
+    p_p, p_i, p_d = gains[:, 0], gains[:, 1], gains[:, 2]
+    n = len(gains)
+    max_vel, acceleration, max_steering_angle = MAX_VEL, 0.1, 4.0
+
+    # state of the cars that are still inside the frame, compacted as cars leave
+    car = np.arange(n)  # gain set index of each active car
+    x = np.full(n, float(START_POS[0]))
+    y = np.full(n, float(START_POS[1]))
+    angle = np.full(n, float(START_ANGLE))
+    vel = np.zeros(n)
+    prev_cte = np.zeros(n)
+    cte_sum = np.zeros(n)  # running integral of the CTE
+    frames = 0
+
+    # metrics of the active cars
+    cte_abs_sum = np.zeros(n)
+    cte_sq_sum = np.zeros(n)
+    cte_max_abs = np.zeros(n)
+    zero_crossings = np.zeros(n, dtype=int)
+    in_band_run = np.zeros(n, dtype=int)    # consecutive frames with |CTE| in the settling band
+    settle_frame = np.zeros(n, dtype=int)   # 0 while not settled
+    u_abs_sum = np.zeros(n)
+    u_sq_sum = np.zeros(n)
+
+    # final metrics of every car, filled in when it leaves the frame or the simulation ends
+    names = ["frames", "cte_abs_sum", "cte_sq_sum", "cte_max_abs", "zero_crossings", "settle_frame",
+             "u_abs_sum", "u_sq_sum", "oob"]
+    final = {name: np.zeros(n) for name in names}
+
+    def store(index, oob):
+        values = [frames, cte_abs_sum[index], cte_sq_sum[index], cte_max_abs[index], zero_crossings[index],
+                  settle_frame[index], u_abs_sum[index], u_sq_sum[index], oob]
+        for name, value in zip(names, values):
+            final[name][car[index]] = value
+
+    for _ in range(max_frames):
+        if len(car) == 0:
+            break
+        frames += 1
+        # PID control
+        cte = y - TARGET_Y
+        cte_sum += cte
+        u = -p_p * cte - p_d * (cte - prev_cte) - p_i * cte_sum
+        if steer_bias:
+            u += STEER_BIAS
+        np.clip(u, -max_steering_angle, max_steering_angle, out=u)
+        angle -= (vel / max_vel) * u
+
+        # metrics
+        abs_cte = np.abs(cte)
+        cte_abs_sum += abs_cte
+        cte_sq_sum += cte * cte
+        np.maximum(cte_max_abs, abs_cte, out=cte_max_abs)
+        if frames > 1:
+            zero_crossings += prev_cte * cte < 0
+        prev_cte = cte
+        in_band_run = np.where(abs_cte <= EPS_CTE, in_band_run + 1, 0)
+        settle_frame[(settle_frame == 0) & (in_band_run >= SETTLE_FRAMES)] = frames
+        u_abs_sum += np.abs(u)
+        u_sq_sum += u * u
+
+        # drive forward
+        vel = np.minimum(vel + acceleration, max_vel)
+        radians = np.radians(angle)
+        y -= np.cos(radians) * vel
+        x -= np.sin(radians) * vel
+        if wind:
+            y -= WIND
+
+        left = out_of_bounds(x, y)
+        if left.any():
+            store(left, 1)
+            stay = ~left
+            car, x, y, angle, vel, prev_cte, cte_sum = car[stay], x[stay], y[stay], angle[stay], vel[stay], prev_cte[stay], cte_sum[stay]
+            p_p, p_i, p_d = p_p[stay], p_i[stay], p_d[stay]
+            cte_abs_sum, cte_sq_sum, cte_max_abs = cte_abs_sum[stay], cte_sq_sum[stay], cte_max_abs[stay]
+            zero_crossings, in_band_run, settle_frame = zero_crossings[stay], in_band_run[stay], settle_frame[stay]
+            u_abs_sum, u_sq_sum = u_abs_sum[stay], u_sq_sum[stay]
+    store(np.ones(len(car), dtype=bool), 0)  # cars still inside the frame after max_frames
+
+    n_frames = np.maximum(final["frames"], 1)
+    return {
+        "frames": n_frames.astype(int),
+        "rmse": np.sqrt(final["cte_sq_sum"] / n_frames),
+        "mean_abs_cte": final["cte_abs_sum"] / n_frames,
+        "max_abs_cte": final["cte_max_abs"],
+        "settle_time": np.where(final["settle_frame"] > 0, final["settle_frame"] / FPS, np.nan),
+        "mean_abs_u": final["u_abs_sum"] / n_frames,
+        "mean_sq_u": final["u_sq_sum"] / n_frames,
+        "zero_crossings": final["zero_crossings"].astype(int),
+        "oob": final["oob"].astype(int),
+    }
+
+
+def gain_grid(p_p, p_i, p_d):
+    """All combinations of the given values of each gain, as an array of shape (n, 3)."""
+    return np.stack(np.meshgrid(p_p, p_i, p_d, indexing="ij"), axis=-1).reshape(-1, 3)
+
+
+if __name__ == "__main__":
+    # one run with the default gains
+    run().final_report()
+
+    # sweep a grid of gain sets at once
+    gains = gain_grid(np.linspace(0.005, 0.05, 10), np.linspace(0.0, 0.0002, 10), np.linspace(0.1, 1.0, 10))
+    start = time.perf_counter()
+    results = simulate(gains)
+    seconds = time.perf_counter() - start
+    print(f"\nSimulated {len(gains)} gain sets, {results['frames'].sum()} frames in {seconds:.2f} s "
+          f"({results['frames'].sum() / seconds / 1000:.0f} frames/ms)")
+    print("Best gain sets by RMSE(CTE):")
+    for k in np.argsort(results["rmse"])[:5]:
+        settle = results["settle_time"][k]
+        print(f"  p_p={gains[k, 0]:.4f} p_i={gains[k, 1]:.6f} p_d={gains[k, 2]:.2f}   "
+              f"RMSE={results['rmse'][k]:.2f} px   settle={'-' if np.isnan(settle) else f'{settle:.2f} s'}")
@@ -8,12 +8,14 @@ By Thomas Moerland
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
 from scipy.signal import savgol_filter
+# matplotlib is imported by the plot classes on construction, so that the
+# non-plotting helpers (e.g. PhaseProfiler) can be used without it
 
 class LearningCurvePlot:
 
     def __init__(self,title=None):
+        import matplotlib.pyplot as plt
         self.fig,self.ax = plt.subplots()
         self.ax.set_xlabel('Timestep')
         self.ax.set_ylabel('Episode Return')      
@@ -34,6 +36,10 @@ class LearningCurvePlot:
     def add_hline(self,height,label):
         self.ax.axhline(height,ls='--',c='k',label=label)
 
+    def add_band(self,x,lower,upper):
+        ''' shade the area between the vectors lower and upper, e.g. mean +- standard error '''
+        self.ax.fill_between(x,lower,upper,alpha=0.2)
+
     def save(self,name='test.png'):
         ''' name: string for filename of saved figure '''
         self.ax.legend()
@@ -42,6 +48,7 @@ class LearningCurvePlot:
 class ComparisonPlot:
 
     def __init__(self,title=None):
+        import matplotlib.pyplot as plt
         self.fig,self.ax = plt.subplots()
         self.ax.set_xlabel('Parameter (exploration)')
         self.ax.set_ylabel('Average reward') 
@@ -63,6 +70,154 @@ class ComparisonPlot:
         self.ax.legend()
         self.fig.savefig(name,dpi=300)
 
+class StreamingLearningCurve:
+    ''' Accumulates learning curves of many repetitions without storing them.
+    For every evaluation point it keeps the number of observed returns and a running mean and
+    sum of squared deviations (Welford), so memory only depends on the number of points.
+    Returns can be added per full repetition (add_repetition) or per point as they come in (add) '''
+
+    def __init__(self,x):
+        ''' x: vector of evaluation timesteps '''
+        self.x = np.asarray(x)
+        self.n = np.zeros(len(self.x),dtype=int)
+        self.mean = np.zeros(len(self.x))
+        self.M2 = np.zeros(len(self.x))
+
+    def add(self,index,value):
+        ''' add the return value observed at evaluation point index '''
+        self.n[index] += 1
+        delta = value - self.mean[index]
+        self.mean[index] += delta / self.n[index]
+        self.M2[index] += delta * (value - self.mean[index])
+
+    def add_repetition(self,y):
+        ''' add a (possibly partial) learning curve y of one repetition, starting at the first point '''
+        index = np.arange(len(y))
+        self.n[index] += 1
+        delta = y - self.mean[index]
+        self.mean[index] += delta / self.n[index]
+        self.M2[index] += delta * (y - self.mean[index])
+
+    @property
+    def n_points(self):
+        ''' number of leading evaluation points that have at least one observed return '''
+        return len(self.n) if np.all(self.n > 0) else int(np.argmin(self.n > 0))
+
+    def variance(self):
+        return self.M2 / np.maximum(self.n - 1,1)
+
+    def standard_error(self):
+        return np.sqrt(self.variance() / np.maximum(self.n,1))
+
+    def smoothed(self,window):
+        ''' trailing moving average of the mean curve over the available points. Unlike smooth it
+        only looks back, so the smoothed values of earlier points do not change as new points arrive '''
+        y = self.mean[:self.n_points]
+        cumulative = np.concatenate([[0.0],np.cumsum(y)])
+        lower = np.maximum(np.arange(len(y)) + 1 - window,0)
+        return (cumulative[1:] - cumulative[lower]) / (np.arange(len(y)) + 1 - lower)
+
+    def flush(self,name,title=None,label=None,window=5):
+        ''' save a plot of the (smoothed) curve so far with a standard error band, e.g. during a long sweep '''
+        import matplotlib.pyplot as plt
+        n_points = self.n_points
+        x = self.x[:n_points]
+        y = self.smoothed(window)
+        error = self.standard_error()[:n_points]
+        plot = LearningCurvePlot(title=title)
+        plot.add_curve(x,y,label=label if label is not None else f'n={self.n.min()}')
+        plot.add_band(x,y - error,y + error)
+        plot.save(name=name)
+        plt.close(plot.fig)
+
+class PhaseProfiler:
+    ''' Opt-in, low-overhead instrumentation of a training loop.
+    add_time accumulates perf_counter_ns durations per phase, count accumulates event counters
+    (e.g. executed planning updates) and observe keeps the mean and maximum of a sampled
+    quantity (e.g. a queue size). Profilers of several runs can be combined with merge '''
+
+    def __init__(self):
+        self.times_ns = {}
+        self.calls = {}
+        self.counters = {}
+        self.observations = {} # name -> [sum, n, max]
+
+    def add_time(self,phase,duration_ns):
+        self.times_ns[phase] = self.times_ns.get(phase,0) + duration_ns
+        self.calls[phase] = self.calls.get(phase,0) + 1
+
+    def count(self,name,n=1):
+        self.counters[name] = self.counters.get(name,0) + n
+
+    def observe(self,name,value):
+        stats = self.observations.setdefault(name,[0.0,0,value])
+        stats[0] += value
+        stats[1] += 1
+        stats[2] = max(stats[2],value)
+
+    def merge(self,other):
+        ''' Add the measurements of another PhaseProfiler to this one '''
+        for phase,duration_ns in other.times_ns.items():
+            self.times_ns[phase] = self.times_ns.get(phase,0) + duration_ns
+            self.calls[phase] = self.calls.get(phase,0) + other.calls[phase]
+        for name,n in other.counters.items():
+            self.count(name,n)
+        for name,(total,n,maximum) in other.observations.items():
+            stats = self.observations.setdefault(name,[0.0,0,maximum])
+            stats[0] += total
+            stats[1] += n
+            stats[2] = max(stats[2],maximum)
+        return self
+
+    def to_dict(self):
+        ''' The measurements as a dict of plain Python values, e.g. to store them as JSON '''
+        return {'times_ns': {phase: int(t) for phase,t in self.times_ns.items()},
+                'calls': {phase: int(n) for phase,n in self.calls.items()},
+                'counters': {name: n.item() if isinstance(n,np.generic) else n for name,n in self.counters.items()},
+                'observations': {name: [float(total),int(n),float(maximum)]
+                                 for name,(total,n,maximum) in self.observations.items()}}
+
+    @classmethod
+    def from_dict(cls,measurements):
+        ''' Rebuilds a PhaseProfiler from the output of to_dict '''
+        profiler = cls()
+        profiler.times_ns = dict(measurements['times_ns'])
+        profiler.calls = dict(measurements['calls'])
+        profiler.counters = dict(measurements['counters'])
+        profiler.observations = {name: list(stats) for name,stats in measurements['observations'].items()}
+        return profiler
+
+def profile_table(profilers):
+    ''' profilers: dict of row label -> PhaseProfiler
+    Returns a text table with the seconds spent per phase (and its share of the total),
+    the counters, and the mean/max of the observed quantities of every profiler '''
+    phases,counters,observations = [],[],[]
+    for profiler in profilers.values():
+        phases += [phase for phase in profiler.times_ns if phase not in phases]
+        counters += [name for name in profiler.counters if name not in counters]
+        observations += [name for name in profiler.observations if name not in observations]
+    header = ['config'] + [f'{phase} [s]' for phase in phases] + ['total [s]'] + counters
+    header += [f'{name} mean/max' for name in observations]
+    rows = []
+    for label,profiler in profilers.items():
+        total_ns = sum(profiler.times_ns.values())
+        row = [str(label)]
+        for phase in phases:
+            duration_ns = profiler.times_ns.get(phase,0)
+            row.append(f'{duration_ns/1e9:.3f} ({100*duration_ns/max(total_ns,1):.0f}%)')
+        row.append(f'{total_ns/1e9:.3f}')
+        row += [str(profiler.counters.get(name,0)) for name in counters]
+        for name in observations:
+            if name in profiler.observations:
+                total,n,maximum = profiler.observations[name]
+                row.append(f'{total/n:.1f}/{maximum}')
+            else:
+                row.append('-')
+        rows.append(row)
+    widths = [max(len(line[i]) for line in [header]+rows) for i in range(len(header))]
+    lines = ['  '.join(cell.rjust(width) for cell,width in zip(line,widths)) for line in [header]+rows]
+    return '\n'.join(lines)
+
 def smooth(y, window, poly=1):
     '''
     y: vector to be smoothed 
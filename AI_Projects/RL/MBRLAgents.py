@@ -6,107 +6,133 @@ Practical for course 'Reinforcement Learning',
 Bachelor AI, Leiden University, The Netherlands
 By Thomas Moerland
 """
+import weakref
 import numpy as np
-from queue import PriorityQueue
+from time import perf_counter_ns
 from MBRLEnvironment import WindyGridworld
-import random
+from MBRLModels import make_model, ObservedPairs, IndexedPriorityQueue
 
 class DynaAgent:
 
-    def __init__(self, n_states, n_actions, learning_rate, gamma):
+    def __init__(self, n_states, n_actions, learning_rate, gamma, model='sparse', rng=None,
+                 batch_planning=False):
         self.n_states = n_states
         self.n_actions = n_actions
         self.learning_rate = learning_rate
         self.gamma = gamma
-        # Initialize Q-values, transition counts, and reward sums
+        # Do all planning updates of a step as one vectorised batch (see _batch_planning)
+        self.batch_planning = batch_planning
+        # Random number generator for exploration and planning
+        self.rng = rng if rng is not None else np.random.default_rng()
+        # Initialize Q-values and the model store with transition counts and reward sums
         self.Q_sa = np.zeros((n_states, n_actions))
-        self.n_sa_s = np.zeros((n_states, n_actions, n_states))
-        self.R_sa_s = np.zeros((n_states, n_actions, n_states))
+        self.model = make_model(model, n_states, n_actions, rng=self.rng)
         # Keep track of observed (state,action) pairs for planning
-        self.observed_sa = set()
+        self.observed_sa = ObservedPairs(n_states, n_actions, rng=self.rng)
+        self.evaluator = GreedyEvaluator()
+        # Optional Helper.PhaseProfiler that receives the timing and counts of update
+        self.profiler = None
 
     def select_action(self, s, epsilon):
         # ε-greedy action selection
-        if np.random.rand() < epsilon:
-            return np.random.randint(self.n_actions)
+        if self.rng.random() < epsilon:
+            return self.rng.integers(self.n_actions)
         else:
             # Greedy action (break ties randomly)
             best_actions = np.flatnonzero(self.Q_sa[s] == np.max(self.Q_sa[s]))
-            return np.random.choice(best_actions)
+            return self.rng.choice(best_actions)
 
     def update(self, s, a, r, done, s_next, n_planning_updates):
+        profiler = self.profiler
+        if profiler is not None:
+            start_ns = perf_counter_ns()
         # Update model with observed transition
-        self.n_sa_s[s, a, s_next] += 1
-        self.R_sa_s[s, a, s_next] += r
-        self.observed_sa.add((s, a))
+        self.model.update(s, a, r, s_next)
+        self.observed_sa.add(s, a)
         # Q-learning update on real experience
         if done:
             target = r
         else:
             target = r + self.gamma * np.max(self.Q_sa[s_next])
         self.Q_sa[s, a] += self.learning_rate * (target - self.Q_sa[s, a])
+        if profiler is not None:
+            planning_start_ns = perf_counter_ns()
+            profiler.add_time('model_update', planning_start_ns - start_ns)
         # Planning updates (Dyna-Q style)
+        n_executed = 0
+        if self.batch_planning and n_planning_updates > 0:
+            self._batch_planning(n_planning_updates)
+            n_executed, n_planning_updates = n_planning_updates, 0
         for _ in range(n_planning_updates):
-            if not self.observed_sa:
+            if len(self.observed_sa) == 0:
                 break
+            n_executed += 1
             # Sample a random previously observed (s,a)
-            s_p, a_p = random.choice(list(self.observed_sa))
-            counts = self.n_sa_s[s_p, a_p]
-            total = counts.sum()
-            if total == 0:
-                continue
-            # Sample next state from estimated transition model
-            probabilities = counts / total
-            s_prime = np.random.choice(self.n_states, p=probabilities)
-            # Predicted reward = average of observed rewards for (s_p,a_p,s_prime)
-            r_pred = self.R_sa_s[s_p, a_p, s_prime] / self.n_sa_s[s_p, a_p, s_prime]
+            s_p, a_p = self.observed_sa.sample()
+            # Sample next state from estimated transition model, with the
+            # predicted reward = average of observed rewards for (s_p,a_p,s_prime)
+            s_prime, r_pred = self.model.sample(s_p, a_p)
             # Q update using simulated experience
             target_model = r_pred + self.gamma * np.max(self.Q_sa[s_prime])
             self.Q_sa[s_p, a_p] += self.learning_rate * (target_model - self.Q_sa[s_p, a_p])
+        if profiler is not None:
+            profiler.add_time('planning', perf_counter_ns() - planning_start_ns)
+            profiler.count('planning_updates', n_executed)
 
-    def evaluate(self, eval_env, n_eval_episodes=30, max_episode_length=100):
-        returns = []
-        for i in range(n_eval_episodes):
-            s = eval_env.reset()
-            R_ep = 0
-            for t in range(max_episode_length):
-                a = np.argmax(self.Q_sa[s])  # Greedy action
-                s_prime, r, done = eval_env.step(a)
-                R_ep += r
-                if done:
-                    break
-                s = s_prime
-            returns.append(R_ep)
-        return np.mean(returns)
+    def _batch_planning(self, n_planning_updates):
+        # Draw all (s,a) pairs and their model successors at once
+        s_p, a_p = self.observed_sa.sample_batch(n_planning_updates)
+        s_prime, r_pred = self.model.sample_batch(s_p, a_p)
+        # All targets are computed from the current Q-table
+        targets = r_pred + self.gamma * np.max(self.Q_sa[s_prime], axis=1)
+        # A pair that was drawn k times gets the effect of k sequential updates towards its
+        # mean target, 1-(1-learning_rate)^k, instead of k summed steps that could overshoot
+        sa, index, k = np.unique(s_p * self.n_actions + a_p, return_inverse=True, return_counts=True)
+        mean_targets = np.bincount(index, weights=targets) / k
+        step_sizes = 1 - (1 - self.learning_rate) ** k
+        Q_flat = self.Q_sa.reshape(-1) # view on self.Q_sa
+        Q_flat[sa] += step_sizes * (mean_targets - Q_flat[sa])
+
+    def evaluate(self, eval_env, n_eval_episodes=30, max_episode_length=100, exact=False):
+        # Mean return of the greedy policy, re-sampled only when the greedy policy changed
+        # exact=True computes the expected return from the true model instead of sampling episodes
+        return np.mean(self.evaluator.evaluate(self.Q_sa, eval_env, n_eval_episodes, max_episode_length, exact))
 
 class PrioritizedSweepingAgent:
 
-    def __init__(self, n_states, n_actions, learning_rate, gamma, priority_cutoff=0.01):
+    def __init__(self, n_states, n_actions, learning_rate, gamma, priority_cutoff=0.01, model='sparse', rng=None):
         self.n_states = n_states
         self.n_actions = n_actions
         self.learning_rate = learning_rate
         self.gamma = gamma
+        # Random number generator for exploration and planning
+        self.rng = rng if rng is not None else np.random.default_rng()
         self.priority_cutoff = priority_cutoff
-        self.queue = PriorityQueue()
-        # Initialize Q-values, transition counts, and reward sums
+        # Queue over state-action ids s*n_actions+a, each (s,a) is queued at most once
+        self.queue = IndexedPriorityQueue(n_states * n_actions)
+        # Initialize Q-values and the model store with transition counts and reward sums
         self.Q_sa = np.zeros((n_states, n_actions))
-        self.n_sa_s = np.zeros((n_states, n_actions, n_states))
-        self.R_sa_s = np.zeros((n_states, n_actions, n_states))
+        self.model = make_model(model, n_states, n_actions, rng=self.rng)
         # Predecessor list for prioritized sweeping: for each state, which (s,a) lead to it
         self.predecessors = {s: set() for s in range(n_states)}
+        self.evaluator = GreedyEvaluator()
+        # Optional Helper.PhaseProfiler that receives the timing and counts of update
+        self.profiler = None
 
     def select_action(self, s, epsilon):
         # ε-greedy action selection
-        if np.random.rand() < epsilon:
-            return np.random.randint(self.n_actions)
+        if self.rng.random() < epsilon:
+            return self.rng.integers(self.n_actions)
         else:
             best_actions = np.flatnonzero(self.Q_sa[s] == np.max(self.Q_sa[s]))
-            return np.random.choice(best_actions)
+            return self.rng.choice(best_actions)
 
     def update(self, s, a, r, done, s_next, n_planning_updates):
+        profiler = self.profiler
+        if profiler is not None:
+            start_ns = perf_counter_ns()
         # Update model with observed transition
-        self.n_sa_s[s, a, s_next] += 1
-        self.R_sa_s[s, a, s_next] += r
+        self.model.update(s, a, r, s_next)
         # Update predecessors of s_next
         self.predecessors[s_next].add((s, a))
         # Q-learning update on real experience
@@ -119,46 +145,101 @@ class PrioritizedSweepingAgent:
         # Compute priority for (s,a)
         p = abs(target - old_Q)
         if p > self.priority_cutoff:
-            # Use negative priority because Python's PriorityQueue pops smallest first
-            self.queue.put((-p, (s, a)))
+            self.queue.push(s * self.n_actions + a, p)
+        if profiler is not None:
+            planning_start_ns = perf_counter_ns()
+            profiler.add_time('model_update', planning_start_ns - start_ns)
+            profiler.observe('queue_size', len(self.queue))
         # Perform K planning steps with prioritized sweeping
+        n_executed = 0
         for _ in range(n_planning_updates):
             if self.queue.empty():
                 break
-            _, (s_p, a_p) = self.queue.get()
-            counts = self.n_sa_s[s_p, a_p]
-            total = counts.sum()
-            if total == 0:
-                continue
-            probabilities = counts / total
-            s_prime = np.random.choice(self.n_states, p=probabilities)
-            # Predicted reward for (s_p, a_p, s_prime)
-            r_pred = self.R_sa_s[s_p, a_p, s_prime] / self.n_sa_s[s_p, a_p, s_prime]
+            n_executed += 1
+            sa, _ = self.queue.pop()
+            s_p, a_p = divmod(sa, self.n_actions)
+            # Sample next state and predicted reward for (s_p, a_p, s_prime)
+            s_prime, r_pred = self.model.sample(s_p, a_p)
             old_Q_sim = self.Q_sa[s_p, a_p]
             # Update Q for simulated experience
             target_sim = r_pred + self.gamma * np.max(self.Q_sa[s_prime])
             self.Q_sa[s_p, a_p] += self.learning_rate * (target_sim - self.Q_sa[s_p, a_p])
             # Update priorities for predecessors of state s_p
             for (s_bar, a_bar) in self.predecessors[s_p]:
-                r_bar = self.R_sa_s[s_bar, a_bar, s_p] / self.n_sa_s[s_bar, a_bar, s_p]
+                r_bar = self.model.mean_reward(s_bar, a_bar, s_p)
                 p_bar = abs(r_bar + self.gamma * np.max(self.Q_sa[s_p]) - self.Q_sa[s_bar, a_bar])
                 if p_bar > self.priority_cutoff:
-                    self.queue.put((-p_bar, (s_bar, a_bar)))
-
-    def evaluate(self, eval_env, n_eval_episodes=30, max_episode_length=100):
-        returns = []
-        for i in range(n_eval_episodes):
-            s = eval_env.reset()
-            R_ep = 0
-            for t in range(max_episode_length):
-                a = np.argmax(self.Q_sa[s])  # Greedy action
-                s_prime, r, done = eval_env.step(a)
-                R_ep += r
-                if done:
-                    break
-                s = s_prime
-            returns.append(R_ep)
-        return np.mean(returns)
+                    self.queue.push(s_bar * self.n_actions + a_bar, p_bar)
+        if profiler is not None:
+            profiler.add_time('planning', perf_counter_ns() - planning_start_ns)
+            profiler.count('planning_updates', n_executed)
+
+    def evaluate(self, eval_env, n_eval_episodes=30, max_episode_length=100, exact=False):
+        # Mean return of the greedy policy, re-sampled only when the greedy policy changed
+        # exact=True computes the expected return from the true model instead of sampling episodes
+        return np.mean(self.evaluator.evaluate(self.Q_sa, eval_env, n_eval_episodes, max_episode_length, exact))
+
+class GreedyEvaluator:
+    ''' Evaluates the greedy policy of a Q-table by rolling out all evaluation episodes as one batch.
+    The returns of the last evaluation are cached together with the greedy policy that produced them,
+    and are reused as long as the argmax policy (and the evaluation setting) stays the same.
+    The evaluation env is held by a weak reference, so a new env that happens to get the id()
+    of a collected one never hits the cache '''
+
+    def __init__(self):
+        self.policy = None
+        self.env_ref = None
+        self.setting = None
+        self.returns = None
+
+    def evaluate(self, Q_sa, eval_env, n_eval_episodes=30, max_episode_length=100, exact=False):
+        ''' Returns the array of n_eval_episodes returns of the greedy policy of Q_sa in eval_env
+        If exact=True, returns a single-element array with the expected return instead '''
+        policy = np.argmax(Q_sa, axis=1)
+        setting = (eval_env.wind_proportion, n_eval_episodes, max_episode_length, exact)
+        same_env = self.env_ref is not None and self.env_ref() is eval_env
+        if self.returns is None or not same_env or setting != self.setting or not np.array_equal(policy, self.policy):
+            if exact:
+                self.returns = np.array([expected_return(policy, eval_env, max_episode_length)])
+            else:
+                self.returns = rollout_returns(policy, eval_env, n_eval_episodes, max_episode_length)
+            self.policy = policy
+            self.env_ref = weakref.ref(eval_env)
+            self.setting = setting
+        return self.returns
+
+def rollout_returns(policy, env, n_episodes, max_episode_length):
+    ''' Plays n_episodes episodes of the deterministic policy (one action per state) in lockstep,
+    using the transition tables and random number generator of env.
+    Returns the undiscounted return of every episode '''
+    s = np.full(n_episodes, env.reset())
+    returns = np.zeros(n_episodes)
+    running = np.ones(n_episodes, dtype=bool)
+    for t in range(max_episode_length):
+        a = policy[s]
+        windy = (env.rng.random(n_episodes) < env.wind_proportion).astype(int)
+        returns += running * env.reward_table[s, a, windy]
+        running &= ~env.done_table[s, a, windy]
+        if not running.any():
+            break
+        s = env.next_state_table[s, a, windy]
+    return returns
+
+def expected_return(policy, env, max_episode_length):
+    ''' Exact expected undiscounted return of the deterministic policy from the start state of env,
+    for episodes that are cut off after max_episode_length steps (as in rollout_returns).
+    Iterates the finite-horizon policy evaluation backup over the Markov chain of the policy,
+    using the transition tables and wind probabilities of env '''
+    states = np.arange(env.n_states)
+    a = policy[states]
+    p = env.outcome_probabilities # probability of the calm and windy outcome
+    next_states = env.next_state_table[states, a] # (n_states,2)
+    rewards = env.reward_table[states, a] @ p
+    continues = ~env.done_table[states, a] * p # probability of each outcome that does not terminate
+    V = np.zeros(env.n_states) # expected return with 0 steps to go
+    for h in range(max_episode_length):
+        V = rewards + np.sum(continues * V[next_states], axis=1)
+    return V[env.reset()]
 
 def test():
     n_timesteps = 10001
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MBRLBenchmark.py
+
+Micro-benchmarks for the model-based agents, and a scaling benchmark of
+both agents on procedurally generated gridworlds of growing size.
+"""
+
+import time
+import tracemalloc
+import numpy as np
+from MBRLEnvironment import WindyGridworld, generate_gridworld
+from MBRLAgents import DynaAgent, PrioritizedSweepingAgent
+
+def time_updates(agent, env, n_updates, n_planning_updates, epsilon=0.1):
+    """
+    Run n_updates interaction steps of agent in env and return the
+    average wall time of a single agent.update call in seconds.
+    """
+    s = env.reset()
+    total = 0.0
+    for _ in range(n_updates):
+        a = agent.select_action(s, epsilon)
+        s_next, r, done = env.step(a)
+        start = time.perf_counter()
+        agent.update(s, a, r, done, s_next, n_planning_updates)
+        total += time.perf_counter() - start
+        s = env.reset() if done else s_next
+    return total / n_updates
+
+def benchmark_planning_updates(planning_steps=(0, 1, 3, 5, 10, 30, 100, 500), n_warmup=2000,
+                               n_updates=2000, learning_rate=0.2, gamma=1.0, batch_planning=False):
+    """
+    Measure how the cost of DynaAgent.update scales with the number of planning
+    updates per real step. The agent is first trained for n_warmup steps so that
+    most (s,a) pairs are already observed, as in the later part of a real run.
+    batch_planning=True measures the vectorised batched planning mode.
+    """
+    print(f"DynaAgent.update, batch_planning={batch_planning}")
+    print(f"{'planning':>8}  {'us/update':>10}  {'us/planning step':>16}")
+    timings = {}
+    for n_planning in planning_steps:
+        env = WindyGridworld()
+        agent = DynaAgent(env.n_states, env.n_actions, learning_rate, gamma,
+                          batch_planning=batch_planning)
+        time_updates(agent, env, n_warmup, 0, epsilon=1.0)
+        timings[n_planning] = time_updates(agent, env, n_updates, n_planning)
+        per_step = timings[n_planning] / n_planning if n_planning > 0 else float('nan')
+        print(f"{n_planning:>8}  {1e6 * timings[n_planning]:>10.1f}  {1e6 * per_step:>16.2f}")
+    return timings
+
+def train_agent(agent_class, env, n_steps, n_planning_updates, epsilon, learning_rate, gamma, seed):
+    """
+    Build an agent for env and train it for n_steps, returns the trained agent.
+    """
+    agent = agent_class(env.n_states, env.n_actions, learning_rate, gamma,
+                        rng=np.random.default_rng(seed))
+    s = env.reset()
+    for _ in range(n_steps):
+        a = agent.select_action(s, epsilon)
+        s_next, r, done = env.step(a)
+        agent.update(s, a, r, done, s_next, n_planning_updates)
+        s = env.reset() if done else s_next
+    return agent
+
+def benchmark_scaling(grid_sizes=((10, 10), (100, 100), (400, 250)), n_steps=5000,
+                      n_planning_updates=5, epsilon=0.1, learning_rate=0.2, gamma=1.0, seed=0):
+    """
+    Train DynaAgent and PrioritizedSweepingAgent for n_steps on generated
+    gridworlds of the given (width, height), i.e. 10^2, 10^4 and 10^5 states
+    by default, and report the training speed in steps/second together with
+    the peak memory allocated while building and training the agent. Memory
+    is measured in a second, traced run, since tracing slows down training.
+    """
+    print(f"{'agent':>6}  {'states':>8}  {'steps/s':>9}  {'peak MB':>8}")
+    report = {}
+    for width, height in grid_sizes:
+        env = generate_gridworld(width, height, n_goals=max(1, width * height // 10000),
+                                 obstacle_density=0.1, seed=seed)
+        for agent_key, agent_class in [('dyna', DynaAgent), ('ps', PrioritizedSweepingAgent)]:
+            start = time.perf_counter()
+            train_agent(agent_class, env, n_steps, n_planning_updates, epsilon, learning_rate, gamma, seed)
+            steps_per_second = n_steps / (time.perf_counter() - start)
+            tracemalloc.start()
+            train_agent(agent_class, env, n_steps, n_planning_updates, epsilon, learning_rate, gamma, seed)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            report[(agent_key, env.n_states)] = (steps_per_second, peak_mb)
+            print(f"{agent_key:>6}  {env.n_states:>8}  {steps_per_second:>9.0f}  {peak_mb:>8.1f}")
+    return report
+
+if __name__ == '__main__':
+    benchmark_planning_updates()
+    benchmark_planning_updates(batch_planning=True)
+    benchmark_scaling()
@@ -8,21 +8,33 @@ By Thomas Moerland
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle,Circle,Arrow
+# matplotlib is only imported once something is rendered, so the training loop stays headless
 
 class WindyGridworld:
-    ''' Implementation of Example 6.5 at page 130 of Sutton & Barto '''
+    ''' Implementation of Example 6.5 at page 130 of Sutton & Barto
+    The defaults give the 10x7 gridworld of the book, the layout arguments allow other
+    grids (see generate_gridworld) with the same interface '''
     
-    def __init__(self, wind_proportion=0.95, default_reward_per_timestep=-1.0):
-        self.height = 7
-        self.width = 10
+    def __init__(self, wind_proportion=0.95, default_reward_per_timestep=-1.0, rng=None,
+                 width=10, height=7, winds=(0,0,0,1,1,1,2,2,1,0), start_location=(0,3),
+                 goals=None, obstacles=None):
+        ''' rng: np.random.Generator used for the wind draws, a fresh unseeded one if None
+        winds: upward wind strength of every column
+        goals: dict of terminal (x,y) location -> reward, {(7,3): 100} if None
+        obstacles: boolean (width,height) mask of blocked cells, no obstacles if None '''
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.height = height
+        self.width = width
         self.shape = (self.width, self.height)
         self.n_states = self.height * self.width
         self.n_actions = 4
-        self.winds = (0,0,0,1,1,1,2,2,1,0)
+        self.winds = tuple(int(w) for w in winds)
         self.wind_proportion = wind_proportion
         self.default_reward_per_timestep = default_reward_per_timestep
+        self.start_location = tuple(start_location)
+        self.goals = {(7,3): 100} if goals is None else {tuple(location): r for location,r in goals.items()}
+        self.goal_location, self.goal_reward = next(iter(self.goals.items())) # first goal
+        self.obstacles = np.zeros(self.shape,dtype=bool) if obstacles is None else np.asarray(obstacles,dtype=bool)
         
         self.action_effects = {
                 0: (0, 1),  # up
@@ -33,9 +45,46 @@ class WindyGridworld:
         self.fig = None
         self.Q_labels = None
         self.arrows = None
+        self.shown_Q_values = None # rounded Q-values currently shown in the labels
+        self.shown_policy = None # (n_states,n_actions) mask of the actions that currently have an arrow
         
+        self._build_transition_tables()
         self.reset()
 
+    def _build_transition_tables(self):
+        ''' Precomputes the full dynamics of the gridworld as dense tables, indexed as [s,a,windy],
+        where windy=0 is the calm outcome and windy=1 the outcome when the wind blows.
+        next_state_table holds s', reward_table r and done_table whether s' is terminal.
+        outcome_probabilities holds the probability of the calm and windy outcome.
+        Moves into an obstacle leave the agent in place, wind into an obstacle does not blow '''
+        upper_bound = np.array(self.shape) - 1
+        winds = np.array(self.winds)
+        self.state_locations = np.stack(self.state_to_location(np.arange(self.n_states)),axis=1)
+        self.state_locations.setflags(write=False) # rows are handed out as self.location
+        
+        self.next_state_table = np.zeros((self.n_states,self.n_actions,2),dtype=int)
+        for a in range(self.n_actions):
+            calm = np.clip(self.state_locations + self.action_effects[a],0,upper_bound) # effect of action
+            blocked = self.obstacles[calm[:,0],calm[:,1]]
+            calm[blocked] = self.state_locations[blocked]
+            windy = calm.copy()
+            windy[:,1] += winds[calm[:,0]] # effect of wind
+            windy = np.clip(windy,0,upper_bound)
+            blocked = self.obstacles[windy[:,0],windy[:,1]]
+            windy[blocked] = calm[blocked]
+            self.next_state_table[:,a,0] = self.location_to_state(calm.T)
+            self.next_state_table[:,a,1] = self.location_to_state(windy.T)
+        
+        # Reward and termination depend only on the next state
+        state_rewards = np.full(self.n_states,self.default_reward_per_timestep)
+        terminal = np.zeros(self.n_states,dtype=bool)
+        for location,r in self.goals.items():
+            state_rewards[self.location_to_state(location)] = r
+            terminal[self.location_to_state(location)] = True
+        self.done_table = terminal[self.next_state_table]
+        self.reward_table = state_rewards[self.next_state_table]
+        self.outcome_probabilities = np.array([1.0 - self.wind_proportion,self.wind_proportion])
+
     def state_to_location(self,state):
         ''' bring a state index to an (x,y) location of the agent '''
         return np.unravel_index(state,self.shape)
@@ -46,38 +95,28 @@ class WindyGridworld:
 
     def reset(self):
         ''' set the agent back to the start location '''
-        self.location = np.array([0,3])
-        s = self.location_to_state(self.location)
-        return s
+        self.state = self.location_to_state(self.start_location)
+        self.location = self.state_locations[self.state]
+        return self.state
         
     def step(self,a):
         ''' Forward the environment based on action a 
         Returns the next state, the obtained reward, and a boolean whether the environment terminated '''
-        # Move the agent
-        self.location += self.action_effects[a] # effect of action
-        self.location = np.clip(self.location,(0,0),np.array(self.shape)-1) # bound within grid
-        if np.random.uniform() < self.wind_proportion: # Apply wind with a certain proportion
-            self.location[1] += self.winds[self.location[0]] # effect of wind
-            self.location = np.clip(self.location,(0,0),np.array(self.shape)-1) # bound within grid
-        s_next = self.location_to_state(self.location)    
-        
-        # Check reward and termination
-        if np.all(self.location == (7,3)):
-            done = True
-            r = 100
-#        elif np.all(self.location == (2,0)):  # uncomment this if you want to add another goal with a certain reward
-#            done = True
-#            r = 10
-        else:
-            done = False
-            r = self.default_reward_per_timestep
-        
+        # Look up the outcome of the action, with the wind applied with a certain proportion
+        windy = int(self.rng.random() < self.wind_proportion)
+        s_next = self.next_state_table[self.state,a,windy]
+        r = self.reward_table[self.state,a,windy]
+        done = self.done_table[self.state,a,windy]
+        self.state = s_next
+        self.location = self.state_locations[s_next]
         return s_next, r, done 
 
     def render(self,Q_sa=None,plot_optimal_policy=False,step_pause=0.001):
         ''' Plot the environment 
         if Q_sa is provided, it will also plot the Q(s,a) values for each action in each state
-        if plot_optimal_policy=True, it will additionally add an arrow in each state to indicate the greedy action '''
+        if plot_optimal_policy=True, it will additionally add an arrow in each state to indicate the greedy action
+        Only the labels and arrows whose value or greedy action changed since the last frame are redrawn '''
+        import matplotlib.pyplot as plt
         # Initialize figure
         if self.fig == None:
             self._initialize_plot()
@@ -87,10 +126,11 @@ class WindyGridworld:
             # Initialize labels
             if self.Q_labels is None:
                 self._initialize_Q_labels()
-            # Set correct values of labels
-            for state in range(self.n_states):
-                for action in range(self.n_actions):
-                    self.Q_labels[state][action].set_text(np.round(Q_sa[state,action],1))
+            # Set correct values of the labels that changed
+            Q_values = np.round(Q_sa,1)
+            for state,action in np.argwhere(Q_values != self.shown_Q_values):
+                self.Q_labels[state][action].set_text(Q_values[state,action])
+            self.shown_Q_values = Q_values
 
         # Add arrows of optimal policy
         if plot_optimal_policy and Q_sa is not None:
@@ -103,6 +143,8 @@ class WindyGridworld:
         plt.pause(step_pause)
 
     def _initialize_plot(self):
+        import matplotlib.pyplot as plt
+        from matplotlib.patches import Rectangle,Circle
         self.fig,self.ax = plt.subplots()#figsize=(self.width, self.height+1)) # Start a new figure
         self.ax.set_xlim([0,self.width])
         self.ax.set_ylim([0,self.height]) 
@@ -120,11 +162,15 @@ class WindyGridworld:
         self.ax.axhline(self.height,0,self.width,linewidth=5,c='k')
 
 
-        # Indicate start and goal state
-        self.ax.add_patch(Rectangle((0.0, 3.0),1.0,1.0, linewidth=0, facecolor='r',alpha=0.2))
-        self.ax.add_patch(Rectangle((7.0, 3.0),1.0,1.0, linewidth=0, facecolor='g',alpha=0.2))
-        self.ax.text(0.05,3.75, 'S', fontsize=20, c='r')
-        self.ax.text(7.05,3.75, 'G', fontsize=20, c='g')
+        # Indicate obstacles, start and goal states
+        for x,y in np.argwhere(self.obstacles):
+            self.ax.add_patch(Rectangle((x, y),1,1, linewidth=0, facecolor='k'))
+        x,y = self.start_location
+        self.ax.add_patch(Rectangle((x, y),1.0,1.0, linewidth=0, facecolor='r',alpha=0.2))
+        self.ax.text(x+0.05,y+0.75, 'S', fontsize=20, c='r')
+        for x,y in self.goals:
+            self.ax.add_patch(Rectangle((x, y),1.0,1.0, linewidth=0, facecolor='g',alpha=0.2))
+            self.ax.text(x+0.05,y+0.75, 'G', fontsize=20, c='g')
 
 
         # Add agent
@@ -140,21 +186,102 @@ class WindyGridworld:
                 plot_location = np.array(state_location) + 0.42 + 0.35 * np.array(self.action_effects[action])
                 next_label = self.ax.text(plot_location[0],plot_location[1]+0.03,0.0,fontsize=8)
                 self.Q_labels[state].append(next_label)
+        self.shown_Q_values = np.zeros((self.n_states,self.n_actions))
 
     def _plot_arrows(self,Q_sa):
-        if self.arrows is not None: 
-            for arrow in self.arrows:
-                arrow.remove() # Clear all previous arrows
-        self.arrows=[]
-        for state in range(self.n_states):
+        from matplotlib.patches import Arrow
+        if self.arrows is None:
+            self.arrows = [[] for state in range(self.n_states)] # arrow patches per state
+            self.shown_policy = np.zeros((self.n_states,self.n_actions),dtype=bool)
+        policy = Q_sa == np.max(Q_sa,axis=1,keepdims=True)
+        # Only redraw the arrows of states whose set of greedy actions changed
+        for state in np.flatnonzero(np.any(policy != self.shown_policy,axis=1)):
+            for arrow in self.arrows[state]:
+                arrow.remove() # Clear previous arrows of this state
+            self.arrows[state] = []
             plot_location = np.array(self.state_to_location(state)) + 0.5
             max_actions = full_argmax(Q_sa[state])
             for max_action in max_actions:
-                new_arrow = arrow = Arrow(plot_location[0],plot_location[1],self.action_effects[max_action][0]*0.2,
-                                          self.action_effects[max_action][1]*0.2, width=0.05,color='k')
+                new_arrow = Arrow(plot_location[0],plot_location[1],self.action_effects[max_action][0]*0.2,
+                                  self.action_effects[max_action][1]*0.2, width=0.05,color='k')
                 ax_arrow = self.ax.add_patch(new_arrow)
-                self.arrows.append(ax_arrow)
-                
+                self.arrows[state].append(ax_arrow)
+        self.shown_policy = policy
+
+
+class VectorWindyGridworld(WindyGridworld):
+    ''' Batch of batch_size independent WindyGridworlds that are stepped in lockstep.
+    The states of all agents live in one int array, so the action effect, the wind draw
+    and the goal check are single lookups in the transition tables for the whole batch '''
+
+    def __init__(self, batch_size, wind_proportion=0.95, default_reward_per_timestep=-1.0, rng=None, **layout):
+        ''' layout: the width, height, winds, start_location, goals and obstacles of WindyGridworld '''
+        self.batch_size = batch_size
+        super().__init__(wind_proportion=wind_proportion,
+                         default_reward_per_timestep=default_reward_per_timestep, rng=rng, **layout)
+
+    def reset(self,mask=None):
+        ''' set the agents back to the start location
+        if mask is provided, only the environments where mask is True are reset
+        Returns the current state of every environment in the batch '''
+        start_state = self.location_to_state(self.start_location)
+        if mask is None:
+            self.states = np.full(self.batch_size,start_state)
+        else:
+            self.states[mask] = start_state
+        self.location = self.state_locations[self.states[0]] # the first environment is the one that gets rendered
+        return self.states.copy()
+
+    def step(self,a):
+        ''' Forward all environments, a is an array with one action per environment
+        Returns arrays of next states, obtained rewards, and booleans whether each environment terminated '''
+        windy = (self.rng.random(self.batch_size) < self.wind_proportion).astype(int)
+        s_next = self.next_state_table[self.states,a,windy]
+        r = self.reward_table[self.states,a,windy]
+        done = self.done_table[self.states,a,windy]
+        self.states = s_next
+        self.location = self.state_locations[s_next[0]]
+        return s_next.copy(), r, done
+
+    @property
+    def locations(self):
+        ''' (batch_size,2) array with the (x,y) location of every agent '''
+        return self.state_locations[self.states]
+
+
+def generate_gridworld(width, height, n_goals=1, obstacle_density=0.0, wind_profile='random',
+                       max_wind=2, goal_reward=100, seed=None, env_class=WindyGridworld, **kwargs):
+    ''' Procedurally generates a gridworld layout and returns it as an env_class instance.
+    wind_profile: 'none', 'random' (independent strength 0..max_wind per column) or
+    'sine' (a single band of wind that peaks at max_wind in the middle columns)
+    The agent starts at the middle of the left edge, the n_goals goals and the obstacles
+    (a fraction obstacle_density of the cells) are placed at random; goals are not guaranteed
+    to be reachable when there are obstacles. seed only determines the layout, other keyword
+    arguments (wind_proportion, rng, batch_size, ...) are passed on to env_class '''
+    layout_rng = np.random.default_rng(seed)
+    if wind_profile == 'none':
+        winds = np.zeros(width,dtype=int)
+    elif wind_profile == 'random':
+        winds = layout_rng.integers(0,max_wind+1,size=width)
+    elif wind_profile == 'sine':
+        winds = np.round(max_wind*np.sin(np.pi*np.arange(width)/max(width-1,1))).astype(int)
+    else:
+        raise KeyError(f'Wind profile {wind_profile} not implemented')
+    
+    start_location = (0,height//2)
+    start_state = np.ravel_multi_index(start_location,(width,height))
+    candidates = np.delete(np.arange(width*height),start_state)
+    goal_states = layout_rng.choice(candidates,size=n_goals,replace=False)
+    goals = {tuple(int(i) for i in np.unravel_index(s,(width,height))): goal_reward for s in goal_states}
+    
+    obstacles = layout_rng.random((width,height)) < obstacle_density
+    obstacles[start_location] = False
+    for location in goals:
+        obstacles[location] = False
+    return env_class(width=width, height=height, winds=winds, start_location=start_location,
+                     goals=goals, obstacles=obstacles, **kwargs)
+
+
 def full_argmax(x):
     ''' Own variant of np.argmax, since np.argmax only returns the first occurence of the max '''
     return np.where(x == np.max(x))[0]
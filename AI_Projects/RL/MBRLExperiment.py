@@ -6,42 +6,251 @@ MBRLExperiment.py
 Run experiments for DynaAgent and PrioritizedSweepingAgent as specified.
 """
 
+import os
+import math
 import time
 import numpy as np
-from MBRLEnvironment import WindyGridworld
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from MBRLEnvironment import WindyGridworld, VectorWindyGridworld
 from MBRLAgents import DynaAgent, PrioritizedSweepingAgent
-from Helper import LearningCurvePlot, smooth
+from MBRLKernels import run_dyna_chunk
+from MBRLResults import ResultsStore
+from Helper import LearningCurvePlot, PhaseProfiler, StreamingLearningCurve, profile_table, smooth
 
-def run_repetitions(agent_class, n_repetitions, n_timesteps, eval_interval, 
-                    epsilon, learning_rate, gamma, n_planning_updates, wind_proportion):
+agent_classes = {'dyna': DynaAgent, 'ps': PrioritizedSweepingAgent}
+
+def train_repetitions(agent_class, n_repetitions, n_timesteps, eval_interval,
+                      epsilon, learning_rate, gamma, n_planning_updates, wind_proportion, seed=None,
+                      exact_evaluation=False, profiler=None, compiled=False):
     """
-    Run multiple independent repetitions of training an agent and record 
+    Run multiple independent repetitions of training an agent and record
     its performance (mean return) every eval_interval steps.
+    All repetitions run in lockstep on one VectorWindyGridworld, so the
+    environment is stepped once per timestep for the whole batch.
+    seed (an int or np.random.SeedSequence) makes the run reproducible: the
+    environment batch and every repetition get their own spawned Generator.
+    exact_evaluation=True records the exact expected return of the greedy
+    policy instead of the mean of 30 sampled evaluation episodes.
+    If profiler (a Helper.PhaseProfiler) is given, the time spent in action
+    selection, environment steps, model updates, planning and evaluation is
+    recorded in it, together with the agents' planning counters.
+    compiled=True trains DynaAgents with the compiled kernel of MBRLKernels, one
+    repetition after another, so Python is only re-entered at evaluation
+    checkpoints (the profiler then only sees the evaluation phase). Each repetition
+    then trains on its own WindyGridworld with a further spawned Generator, which
+    the kernel draws all training randomness from, so evaluation (on agent.rng)
+    does not shift the training streams. The compiled path makes different draws
+    than the uncompiled one, so its results match in distribution, not exactly.
+    Returns the evaluation timesteps and the (n_repetitions, n_points) returns.
     """
     times = np.arange(0, n_timesteps, eval_interval)
     n_points = len(times)
     returns = np.zeros((n_repetitions, n_points))
-    for i in range(n_repetitions):
-        env = WindyGridworld(wind_proportion=wind_proportion)
-        agent = agent_class(env.n_states, env.n_actions, learning_rate, gamma)
-        s = env.reset()
-        eval_index = 0
-        for t in range(n_timesteps):
-            a = agent.select_action(s, epsilon)
-            s_next, r, done = env.step(a)
-            agent.update(s, a, r, done, s_next, n_planning_updates)
-            if t % eval_interval == 0:
-                eval_env = WindyGridworld(wind_proportion=wind_proportion)
+    seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    env_rng, *rngs = [np.random.default_rng(child) for child in seed_sequence.spawn(n_repetitions + 1)]
+    env = VectorWindyGridworld(n_repetitions, wind_proportion=wind_proportion, rng=env_rng)
+    agents = [agent_class(env.n_states, env.n_actions, learning_rate, gamma, rng=rng)
+              for rng in rngs]
+    eval_envs = [WindyGridworld(wind_proportion=wind_proportion, rng=agent.rng) for agent in agents]
+    if compiled and agent_class is DynaAgent:
+        # Steps between checkpoints: the first evaluation follows the update at t=0
+        chunks = np.diff(np.append(times, n_timesteps - 1), prepend=-1)
+        train_envs = [WindyGridworld(wind_proportion=wind_proportion, rng=np.random.default_rng(child))
+                      for child in seed_sequence.spawn(n_repetitions)]
+        for i, agent in enumerate(agents):
+            s = train_envs[i].reset()
+            for eval_index, n_steps in enumerate(chunks[:n_points]):
+                s = run_dyna_chunk(agent, train_envs[i], s, n_steps, epsilon, n_planning_updates)
+                if profiler is not None:
+                    eval_start_ns = time.perf_counter_ns()
                 returns[i, eval_index] = agent.evaluate(
-                    eval_env, n_eval_episodes=30, max_episode_length=100)
-                eval_index += 1
-            if done:
-                s = env.reset()
-            else:
-                s = s_next
+                    eval_envs[i], n_eval_episodes=30, max_episode_length=100, exact=exact_evaluation)
+                if profiler is not None:
+                    profiler.add_time('evaluate', time.perf_counter_ns() - eval_start_ns)
+            run_dyna_chunk(agent, train_envs[i], s, chunks[n_points], epsilon, n_planning_updates)
+        return times, returns
+    for agent in agents:
+        agent.profiler = profiler # agents time their own model update and planning phases
+    s = env.reset()
+    a = np.zeros(n_repetitions, dtype=int)
+    eval_index = 0
+    for t in range(n_timesteps):
+        if profiler is not None:
+            start_ns = time.perf_counter_ns()
+        for i, agent in enumerate(agents):
+            a[i] = agent.select_action(s[i], epsilon)
+        if profiler is not None:
+            step_start_ns = time.perf_counter_ns()
+            profiler.add_time('select_action', step_start_ns - start_ns)
+        s_next, r, done = env.step(a)
+        if profiler is not None:
+            profiler.add_time('env_step', time.perf_counter_ns() - step_start_ns)
+        for i, agent in enumerate(agents):
+            agent.update(s[i], a[i], r[i], done[i], s_next[i], n_planning_updates)
+        if t % eval_interval == 0:
+            if profiler is not None:
+                eval_start_ns = time.perf_counter_ns()
+            for i, agent in enumerate(agents):
+                returns[i, eval_index] = agent.evaluate(
+                    eval_envs[i], n_eval_episodes=30, max_episode_length=100, exact=exact_evaluation)
+            eval_index += 1
+            if profiler is not None:
+                profiler.add_time('evaluate', time.perf_counter_ns() - eval_start_ns)
+        s = np.where(done, env.reset(mask=done), s_next)
+    return times, returns
+
+def run_repetitions(agent_class, n_repetitions, n_timesteps, eval_interval,
+                    epsilon, learning_rate, gamma, n_planning_updates, wind_proportion, seed=None,
+                    exact_evaluation=False, compiled=False):
+    """
+    Train n_repetitions agents (see train_repetitions) and return the
+    evaluation timesteps and the returns averaged over the repetitions.
+    """
+    times, returns = train_repetitions(agent_class, n_repetitions, n_timesteps, eval_interval,
+                                       epsilon, learning_rate, gamma, n_planning_updates,
+                                       wind_proportion, seed, exact_evaluation, compiled=compiled)
     avg_returns = np.mean(returns, axis=0)
     return times, avg_returns
 
+def job_seed(base_seed, agent_key, wind_proportion, n_planning_updates, chunk):
+    """
+    Deterministic seed of a single (agent, wind, n_planning, chunk) job,
+    independent of the order in which the jobs are executed. The repetitions
+    of the chunk get their own streams by spawning from it in train_repetitions.
+    """
+    spawn_key = (list(agent_classes).index(agent_key), round(1000 * wind_proportion),
+                 n_planning_updates, chunk)
+    return np.random.SeedSequence(base_seed, spawn_key=spawn_key)
+
+def job_config(job):
+    """
+    The settings of a job that determine its result, as stored alongside each of its repetitions
+    in a ResultsStore. The repetitions of a chunk share one batched environment, so the number of
+    repetitions per job and the size of the chunk are part of it. Profiled runtimes include the
+    profiler overhead, so profiled repetitions are stored apart from unprofiled ones.
+    """
+    (agent_key, wind, n_planning, chunk, repetitions, repetitions_per_job, n_timesteps, eval_interval,
+     epsilon, learning_rate, gamma, base_seed, exact_evaluation, profile, compiled) = job
+    return {'agent': agent_key, 'wind_proportion': wind, 'n_planning_updates': n_planning,
+            'n_timesteps': n_timesteps, 'eval_interval': eval_interval, 'epsilon': epsilon,
+            'learning_rate': learning_rate, 'gamma': gamma, 'seed': base_seed,
+            'exact_evaluation': exact_evaluation, 'compiled': compiled,
+            'repetitions_per_job': repetitions_per_job, 'chunk_size': len(repetitions), 'profiled': profile}
+
+def run_job(job):
+    """
+    Train a chunk of repetitions of one configuration in lockstep, used as the unit of work of run_sweep.
+    Returns the job together with its evaluation timesteps, the (len(chunk), n_points) returns,
+    the wall time in seconds per repetition and its PhaseProfiler (None if the job is not profiled).
+    """
+    (agent_key, wind, n_planning, chunk, repetitions, repetitions_per_job, n_timesteps, eval_interval,
+     epsilon, learning_rate, gamma, base_seed, exact_evaluation, profile, compiled) = job
+    seed = job_seed(base_seed, agent_key, wind, n_planning, chunk)
+    profiler = PhaseProfiler() if profile else None
+    start = time.perf_counter()
+    times, returns = train_repetitions(agent_classes[agent_key], len(repetitions), n_timesteps, eval_interval,
+                                       epsilon, learning_rate, gamma, n_planning, wind, seed,
+                                       exact_evaluation, profiler, compiled)
+    runtime = (time.perf_counter() - start) / len(repetitions)
+    return job, times, returns, runtime, profiler
+
+def run_sweep(configs, n_repetitions, n_timesteps, eval_interval, epsilon, learning_rate,
+              gamma, base_seed=0, max_workers=None, exact_evaluation=False, store=None, profile=False,
+              flush_every=None, flush_directory='.', compiled=False, repetitions_per_job=None):
+    """
+    Run every (agent_key, wind_proportion, n_planning_updates) in configs for
+    n_repetitions, fanning the repetitions out over a ProcessPoolExecutor with
+    max_workers processes (all cores if None). The repetitions of a config are
+    grouped into jobs of repetitions_per_job repetitions that train in lockstep on
+    one VectorWindyGridworld; None uses ceil(n_repetitions / workers). The random
+    streams depend on the grouping, so fix repetitions_per_job for results that
+    do not depend on the number of workers.
+    If store (a ResultsStore) is given, every finished repetition is saved to
+    it as soon as its job completes, and jobs whose repetitions are all in the
+    store are loaded instead of re-run, so an interrupted sweep resumes where it stopped.
+    profile=True runs every job with a PhaseProfiler. Profiling is part of the
+    stored config, so unprofiled repetitions in the store are re-run to get their
+    profile, and profiled runtimes (which include the profiler overhead) are never
+    mixed with unprofiled ones. The profile of a job is stored with its first
+    repetition and merged back in when the job is loaded from the store.
+    The returns of finished repetitions are folded into one
+    StreamingLearningCurve per config, so memory does not grow with
+    n_repetitions. With flush_every=k, the partial curve of every config is
+    plotted to flush_directory after each k finished repetitions.
+    compiled=True trains the Dyna configs with the compiled kernel (see train_repetitions).
+    Returns results[agent_key][wind][n_planning] = (times, avg_returns),
+    runtimes[agent_key][wind][n_planning] = average seconds per repetition and
+    profiles[agent_key][wind][n_planning] = the merged PhaseProfiler of the
+    profiled repetitions of a config (empty if profile=False).
+    """
+    times = np.arange(0, n_timesteps, eval_interval)
+    if repetitions_per_job is None:
+        repetitions_per_job = math.ceil(n_repetitions / (max_workers or os.cpu_count() or 1))
+    jobs = [(agent_key, wind, n_planning, chunk,
+             tuple(range(start, min(start + repetitions_per_job, n_repetitions))), repetitions_per_job,
+             n_timesteps, eval_interval, epsilon, learning_rate, gamma, base_seed, exact_evaluation, profile, compiled)
+            for agent_key, wind, n_planning in configs
+            for chunk, start in enumerate(range(0, n_repetitions, repetitions_per_job))]
+    curves = {config: StreamingLearningCurve(times) for config in configs}
+    runtimes = {agent_key: {} for agent_key, _, _ in configs}
+    profiles = {agent_key: {} for agent_key, _, _ in configs}
+
+    def record(job, repetition_returns, runtime):
+        agent_key, wind, n_planning = job[:3]
+        curves[(agent_key, wind, n_planning)].add_repetition(repetition_returns)
+        # running mean of the runtime per repetition
+        n = curves[(agent_key, wind, n_planning)].n[0]
+        config_runtimes = runtimes[agent_key].setdefault(wind, {})
+        config_runtimes[n_planning] = config_runtimes.get(n_planning, 0.0) + (runtime - config_runtimes.get(n_planning, 0.0)) / n
+
+    def flush():
+        for (agent_key, wind, n_planning), curve in curves.items():
+            if curve.n_points > 0:
+                name = f"partial_{agent_key}_wind{wind}_plan{n_planning}".replace('.', '_') + '.png'
+                curve.flush(os.path.join(flush_directory, name),
+                            title=f"{agent_key} (wind={wind}, planning={n_planning})")
+
+    def merge_profile(job, profiler):
+        agent_key, wind, n_planning = job[:3]
+        profiles[agent_key].setdefault(wind, {}).setdefault(n_planning, PhaseProfiler()).merge(profiler)
+
+    def load_job(job):
+        ''' Records a job from the store; returns False if it has to be (re-)run '''
+        repetitions = job[4]
+        if store is None or not all(store.contains(job_config(job), r) for r in repetitions):
+            return False
+        stored_profile = store.load_profile(job_config(job), repetitions[0]) if profile else None
+        if profile and stored_profile is None:
+            return False # stored without its profile
+        for r in repetitions:
+            _, repetition_returns, runtime = store.load(job_config(job), r)
+            record(job, repetition_returns, runtime)
+        if stored_profile is not None:
+            merge_profile(job, PhaseProfiler.from_dict(stored_profile))
+        return True
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_job, job) for job in jobs if not load_job(job)]
+        n_finished = 0
+        for future in as_completed(futures):
+            job, _, job_returns, runtime, profiler = future.result()
+            for r, repetition_returns in zip(job[4], job_returns):
+                if store is not None:
+                    # the profile of the whole job is kept with its first repetition
+                    job_profile = profiler.to_dict() if profiler is not None and r == job[4][0] else None
+                    store.save(job_config(job), r, times, repetition_returns, runtime, job_profile)
+                record(job, repetition_returns, runtime)
+                n_finished += 1
+                if flush_every is not None and n_finished % flush_every == 0:
+                    flush()
+            if profiler is not None:
+                merge_profile(job, profiler)
+
+    results = {agent_key: {} for agent_key, _, _ in configs}
+    for (agent_key, wind, n_planning), curve in curves.items():
+        results[agent_key].setdefault(wind, {})[n_planning] = (times, curve.mean.copy())
+    return results, runtimes, profiles
+
 def main():
     # Experiment parameters
     n_timesteps = 10001
@@ -50,34 +259,31 @@ def main():
     gamma = 1.0
     learning_rate = 0.2
     epsilon = 0.1
+    seed = 0
+    exact_evaluation = True # exact expected returns instead of 30 sampled evaluation episodes
+    results_directory = 'results'
+    profile = False # record a per-phase time breakdown of every config next to the plots
+    compiled = False # True trains the Dyna configs with the compiled kernel (only fast with numba installed)
+    flush_every = None # e.g. 20 to plot the partial learning curves after every 20 finished repetitions
+    repetitions_per_job = 5 # repetitions trained in lockstep per worker job; fixed so the results do not depend on the core count
 
     wind_proportions = [0.9, 1.0]
 
-    # Store average returns for each agent, wind, and planning
-    results = {'dyna': {}, 'ps': {}}
-
-    # Compute Q-learning baseline (DynaAgent with 0 planning) for each wind
+    # Every (agent, wind, planning) configuration; DynaAgent with 0 planning is the Q-learning baseline
+    configs = [('dyna', wind, 0) for wind in wind_proportions]
     for wind in wind_proportions:
-        times, avg_returns = run_repetitions(
-            DynaAgent, n_repetitions, n_timesteps, eval_interval,
-            epsilon, learning_rate, gamma, 0, wind)
-        results['dyna'].setdefault(wind, {})[0] = (times, avg_returns)
+        configs += [('dyna', wind, n_planning) for n_planning in [1, 3, 5]]
+        configs += [('ps', wind, n_planning) for n_planning in [1, 3, 5]]
 
-    # Run experiments for DynaAgent (planning 1,3,5) and PSAgent (planning 1,3,5)
-    for wind in wind_proportions:
-        # DynaAgent
-        for n_planning in [1, 3, 5]:
-            times, avg_returns = run_repetitions(
-                DynaAgent, n_repetitions, n_timesteps, eval_interval,
-                epsilon, learning_rate, gamma, n_planning, wind)
-            results['dyna'][wind][n_planning] = (times, avg_returns)
-        # Prioritized Sweeping Agent
-        results['ps'].setdefault(wind, {})
-        for n_planning in [1, 3, 5]:
-            times, avg_returns = run_repetitions(
-                PrioritizedSweepingAgent, n_repetitions, n_timesteps, eval_interval,
-                epsilon, learning_rate, gamma, n_planning, wind)
-            results['ps'][wind][n_planning] = (times, avg_returns)
+    # Store average returns and runtimes for each agent, wind, and planning, running all repetitions
+    # in parallel; finished repetitions are kept on disk, so re-running resumes an interrupted sweep
+    store = ResultsStore(results_directory)
+    results, runtimes, profiles = run_sweep(configs, n_repetitions, n_timesteps, eval_interval,
+                                            epsilon, learning_rate, gamma, base_seed=seed,
+                                            exact_evaluation=exact_evaluation, store=store,
+                                            profile=profile, flush_every=flush_every,
+                                            flush_directory=results_directory, compiled=compiled,
+                                            repetitions_per_job=repetitions_per_job)
 
     # Create learning curve plots for each agent and wind
     for agent_key, agent_label in [('dyna', 'dyna'), ('ps', 'ps')]:
@@ -104,6 +310,14 @@ def main():
             filename = f"learning_curve_{agent_label}_wind{wind}".replace('.', '_') + '.png'
             lc_plot.save(name=filename)
             print(f"Saved learning curve for {agent_label} (wind={wind}) to {filename}")
+            # Per-phase time breakdown of the same configs
+            config_profiles = profiles[agent_key].get(wind, {})
+            if config_profiles:
+                filename = f"profile_{agent_label}_wind{wind}".replace('.', '_') + '.txt'
+                with open(filename, 'w') as f:
+                    f.write(profile_table({f"planning={n_planning}": profiler
+                                           for n_planning, profiler in sorted(config_profiles.items())}) + '\n')
+                print(f"Saved time breakdown for {agent_label} (wind={wind}) to {filename}")
 
     # Determine best planning config (highest final return) for each agent and wind
     best_plans = {'dyna': {}, 'ps': {}}
@@ -152,44 +366,15 @@ def main():
         lc_plot.save(name=filename)
         print(f"Saved comparison learning curve for wind={wind} to {filename}")
 
-    # Measure runtime for single repetition (n_repetitions=1) of each algorithm
-    print("\nMeasuring runtimes (single repetition, n_timesteps=10001)...")
-    runtimes = {'0.9': {}, '1.0': {}}
+    # Print runtimes clearly, as recorded for every repetition during the sweep
+    print("\nAverage runtime per single repetition (seconds{}):".format(", including profiler overhead" if profile else ""))
     for wind in wind_proportions:
-        wind_key = str(wind)
-        # Q-learning (DynaAgent with 0 planning)
-        start = time.perf_counter()
-        run_repetitions(DynaAgent, 1, n_timesteps, eval_interval,
-                        epsilon, learning_rate, gamma, 0, wind)
-        end = time.perf_counter()
-        runtimes[wind_key]['Q-learning'] = end - start
-        # Best Dyna
         best_dyna = best_plans['dyna'][wind]
-        start = time.perf_counter()
-        run_repetitions(DynaAgent, 1, n_timesteps, eval_interval,
-                        epsilon, learning_rate, gamma, best_dyna, wind)
-        end = time.perf_counter()
-        key_dyna = f"Dyna (plan={best_dyna})"
-        runtimes[wind_key][key_dyna] = end - start
-        # Best PS
         best_ps = best_plans['ps'][wind]
-        start = time.perf_counter()
-        run_repetitions(PrioritizedSweepingAgent, 1, n_timesteps, eval_interval,
-                        epsilon, learning_rate, gamma, best_ps, wind)
-        end = time.perf_counter()
-        key_ps = f"PS (plan={best_ps})"
-        runtimes[wind_key][key_ps] = end - start
-
-    # Print runtimes clearly
-    print("\nAverage runtime per single repetition (seconds):")
-    for wind in wind_proportions:
-        wind_key = str(wind)
-        key_dyna = f"Dyna (plan={best_plans['dyna'][wind]})"
-        key_ps = f"PS (plan={best_plans['ps'][wind]})"
         print(f"Wind {wind}:")
-        print(f"  Q-learning: {runtimes[wind_key]['Q-learning']:.4f} s")
-        print(f"  {key_dyna}: {runtimes[wind_key][key_dyna]:.4f} s")
-        print(f"  {key_ps}: {runtimes[wind_key][key_ps]:.4f} s")
+        print(f"  Q-learning: {runtimes['dyna'][wind][0]:.4f} s")
+        print(f"  Dyna (plan={best_dyna}): {runtimes['dyna'][wind][best_dyna]:.4f} s")
+        print(f"  PS (plan={best_ps}): {runtimes['ps'][wind][best_ps]:.4f} s")
 
 if __name__ == '__main__':
     main()
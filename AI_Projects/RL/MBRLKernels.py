@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Model-based Reinforcement Learning compiled kernels
+Runs whole chunks of tabular Dyna-Q training (environment step, epsilon-greedy
+action selection, Q-update, model update and planning) in one compiled loop.
+Numba is optional: without it the same kernel runs as plain Python, which is
+correct but slower than DynaAgent.update. The kernels draw from a
+np.random.Generator passed in by the caller (numba supports Generator
+arguments), never from the global np.random state, so a compiled and a plain
+Python run with the same Generator make the same draws.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        ''' Stand-in for numba.njit that returns the function unchanged '''
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+@njit(cache=True)
+def dyna_chunk(Q_sa, next_state_table, reward_table, done_table, wind_proportion, start_state,
+               successors, counts, reward_sums, n_successors, totals,
+               observed_ids, observed_seen, n_observed,
+               s, n_steps, epsilon, learning_rate, gamma, n_planning_updates, rng):
+    ''' Trains for n_steps steps from state s, updating all arrays in place. The environment is given
+    by its transition tables (see WindyGridworld), the model by the arrays of a SparseModel and the
+    observed pairs by the arrays of ObservedPairs. All random draws (exploration, ties, wind and
+    planning samples) come from the Generator rng.
+    Stops early when a new successor does not fit in the capacity of the model rows.
+    Returns the current state, the new number of observed pairs and the number of steps done '''
+    n_actions = Q_sa.shape[1]
+    capacity = successors.shape[1]
+    for step in range(n_steps):
+        # epsilon-greedy action selection, breaking ties randomly
+        if rng.random() < epsilon:
+            a = rng.integers(0, n_actions)
+        else:
+            best = Q_sa[s, 0]
+            n_best = 1
+            a = 0
+            for b in range(1, n_actions):
+                if Q_sa[s, b] > best:
+                    best = Q_sa[s, b]
+                    n_best = 1
+                    a = b
+                elif Q_sa[s, b] == best:
+                    n_best += 1
+                    if rng.integers(0, n_best) == 0: # reservoir sampling among the ties
+                        a = b
+        # environment step
+        windy = 1 if rng.random() < wind_proportion else 0
+        s_next = next_state_table[s, a, windy]
+        r = reward_table[s, a, windy]
+        done = done_table[s, a, windy]
+        # model update
+        sa = s * n_actions + a
+        j = -1
+        for k in range(n_successors[sa]):
+            if successors[sa, k] == s_next:
+                j = k
+                break
+        if j == -1:
+            if n_successors[sa] == capacity:
+                return s, n_observed, step # the model rows have to grow first
+            j = n_successors[sa]
+            successors[sa, j] = s_next
+            n_successors[sa] += 1
+        counts[sa, j] += 1
+        reward_sums[sa, j] += r
+        totals[sa] += 1
+        if not observed_seen[sa]:
+            observed_seen[sa] = True
+            observed_ids[n_observed] = sa
+            n_observed += 1
+        # Q-learning update on real experience
+        target = r
+        if not done:
+            target += gamma * np.max(Q_sa[s_next])
+        Q_sa[s, a] += learning_rate * (target - Q_sa[s, a])
+        # planning updates
+        for _ in range(n_planning_updates):
+            sa_p = observed_ids[rng.integers(0, n_observed)]
+            s_p = sa_p // n_actions
+            a_p = sa_p % n_actions
+            u = rng.integers(0, totals[sa_p])
+            k = 0
+            cumulative = counts[sa_p, 0]
+            while cumulative <= u:
+                k += 1
+                cumulative += counts[sa_p, k]
+            s_prime = successors[sa_p, k]
+            r_pred = reward_sums[sa_p, k] / counts[sa_p, k]
+            target_model = r_pred + gamma * np.max(Q_sa[s_prime])
+            Q_sa[s_p, a_p] += learning_rate * (target_model - Q_sa[s_p, a_p])
+        s = start_state if done else s_next
+    return s, n_observed, n_steps
+
+def run_dyna_chunk(agent, env, s, n_steps, epsilon, n_planning_updates):
+    ''' Trains a DynaAgent with a SparseModel for n_steps steps in env (a WindyGridworld), starting
+    in state s, with dyna_chunk. Episodes that terminate are restarted from the start state.
+    All random draws of the training come from env.rng.
+    Returns the state after the last step '''
+    model = agent.model
+    start_state = env.location_to_state(env.start_location)
+    while n_steps > 0:
+        s, agent.observed_sa.n, n_done = dyna_chunk(
+            agent.Q_sa, env.next_state_table, env.reward_table, env.done_table, env.wind_proportion,
+            start_state, model.successors, model.counts, model.reward_sums, model.n_successors,
+            model.totals, agent.observed_sa.ids, agent.observed_sa.seen, agent.observed_sa.n,
+            s, n_steps, epsilon, agent.learning_rate, agent.gamma, n_planning_updates, env.rng)
+        n_steps -= n_done
+        if n_steps > 0:
+            model._grow() # a new successor did not fit, the interrupted step is redone
+    return s
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Model-based Reinforcement Learning model stores
+Tabular transition and reward models that are learned from observed transitions,
+used by the agents in MBRLAgents.py for planning
+"""
+
+import numpy as np
+
+class DenseModel:
+    ''' Stores transition counts and reward sums in dense (n_states,n_actions,n_states) arrays.
+    Memory grows quadratically in the number of states, so only use this on small problems '''
+
+    def __init__(self, n_states, n_actions, rng=None):
+        self.n_states = n_states
+        self.n_actions = n_actions
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.n_sa_s = np.zeros((n_states, n_actions, n_states))
+        self.R_sa_s = np.zeros((n_states, n_actions, n_states))
+
+    def update(self, s, a, r, s_next):
+        ''' Add an observed transition (s,a,r,s_next) to the model '''
+        self.n_sa_s[s, a, s_next] += 1
+        self.R_sa_s[s, a, s_next] += r
+
+    def sample(self, s, a):
+        ''' Sample a next state from the estimated transition function of (s,a)
+        Returns the next state and the average reward observed for (s,a,s_next) '''
+        counts = self.n_sa_s[s, a]
+        probabilities = counts / counts.sum()
+        s_next = self.rng.choice(self.n_states, p=probabilities)
+        return s_next, self.mean_reward(s, a, s_next)
+
+    def sample_batch(self, s, a):
+        ''' Vectorised sample for arrays of states s and actions a
+        Returns arrays of next states and average observed rewards '''
+        cumulative = np.cumsum(self.n_sa_s[s, a], axis=1)
+        u = self.rng.random(len(s)) * cumulative[:, -1]
+        s_next = np.sum(cumulative <= u[:, None], axis=1)
+        return s_next, self.R_sa_s[s, a, s_next] / self.n_sa_s[s, a, s_next]
+
+    def mean_reward(self, s, a, s_next):
+        ''' Average of the rewards observed for (s,a,s_next) '''
+        return self.R_sa_s[s, a, s_next] / self.n_sa_s[s, a, s_next]
+
+
+class SparseModel:
+    ''' Stores only the observed successors of each (s,a). Every state-action id owns a row
+    in (n_states*n_actions,capacity) arrays of successor states, counts and reward sums, of which
+    the first n_successors[sa] entries are in use. The capacity doubles when a row overflows, so
+    memory scales with the largest number of distinct successors instead of with n_states '''
+
+    def __init__(self, n_states, n_actions, rng=None, initial_capacity=2):
+        self.n_states = n_states
+        self.n_actions = n_actions
+        self.rng = rng if rng is not None else np.random.default_rng()
+        n_sa = n_states * n_actions
+        self.successors = np.full((n_sa, initial_capacity), -1, dtype=int)
+        self.counts = np.zeros((n_sa, initial_capacity), dtype=int)
+        self.reward_sums = np.zeros((n_sa, initial_capacity))
+        self.n_successors = np.zeros(n_sa, dtype=int)
+        self.totals = np.zeros(n_sa, dtype=int)
+
+    def update(self, s, a, r, s_next):
+        ''' Add an observed transition (s,a,r,s_next) to the model '''
+        sa = s * self.n_actions + a
+        k = self.n_successors[sa]
+        hits = np.flatnonzero(self.successors[sa, :k] == s_next)
+        if len(hits) > 0:
+            j = hits[0]
+        else:
+            # first time we observe s_next after (s,a): append it to the row
+            if k == self.successors.shape[1]:
+                self._grow()
+            j = k
+            self.successors[sa, j] = s_next
+            self.n_successors[sa] += 1
+        self.counts[sa, j] += 1
+        self.reward_sums[sa, j] += r
+        self.totals[sa] += 1
+
+    def sample(self, s, a):
+        ''' Sample a next state from the estimated transition function of (s,a) in O(#successors)
+        Returns the next state and the average reward observed for (s,a,s_next) '''
+        sa = s * self.n_actions + a
+        k = self.n_successors[sa]
+        u = self.rng.integers(self.totals[sa])
+        j = np.searchsorted(np.cumsum(self.counts[sa, :k]), u, side='right')
+        return self.successors[sa, j], self.reward_sums[sa, j] / self.counts[sa, j]
+
+    def sample_batch(self, s, a):
+        ''' Vectorised sample for arrays of states s and actions a, in O(len(s) x capacity)
+        Returns arrays of next states and average observed rewards '''
+        sa = s * self.n_actions + a
+        u = self.rng.integers(self.totals[sa])
+        j = np.sum(np.cumsum(self.counts[sa], axis=1) <= u[:, None], axis=1)
+        return self.successors[sa, j], self.reward_sums[sa, j] / self.counts[sa, j]
+
+    def mean_reward(self, s, a, s_next):
+        ''' Average of the rewards observed for (s,a,s_next) '''
+        sa = s * self.n_actions + a
+        j = np.flatnonzero(self.successors[sa, :self.n_successors[sa]] == s_next)[0]
+        return self.reward_sums[sa, j] / self.counts[sa, j]
+
+    def _grow(self):
+        ''' Double the number of successor slots of every (s,a) row '''
+        n_sa, capacity = self.successors.shape
+        self.successors = np.hstack([self.successors, np.full((n_sa, capacity), -1, dtype=int)])
+        self.counts = np.hstack([self.counts, np.zeros((n_sa, capacity), dtype=int)])
+        self.reward_sums = np.hstack([self.reward_sums, np.zeros((n_sa, capacity))])
+
+
+class ObservedPairs:
+    ''' Set of observed (s,a) pairs that supports O(1) insertion and uniform sampling.
+    State-action ids are appended to a fixed-size array the first time they are seen,
+    and a membership bitmap prevents duplicates '''
+
+    def __init__(self, n_states, n_actions, rng=None):
+        self.n_actions = n_actions
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.ids = np.zeros(n_states * n_actions, dtype=int)
+        self.seen = np.zeros(n_states * n_actions, dtype=bool)
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def add(self, s, a):
+        ''' Mark (s,a) as observed '''
+        sa = s * self.n_actions + a
+        if not self.seen[sa]:
+            self.seen[sa] = True
+            self.ids[self.n] = sa
+            self.n += 1
+
+    def sample(self):
+        ''' Draw a uniformly random observed (s,a) pair '''
+        sa = self.ids[self.rng.integers(self.n)]
+        return divmod(sa, self.n_actions)
+
+    def sample_batch(self, size):
+        ''' Draw size uniformly random observed (s,a) pairs, returned as arrays of states and actions '''
+        sa = self.ids[self.rng.integers(self.n, size=size)]
+        return np.divmod(sa, self.n_actions)
+
+
+class IndexedPriorityQueue:
+    ''' Binary max-heap over the integer items 0..n_items-1 in which every item appears at most once.
+    position[item] tracks where an item sits in the heap, so pushing an item that is already queued
+    raises its priority in place instead of adding a duplicate entry.
+    Not thread-safe: it is only meant to be used from within a single agent '''
+
+    def __init__(self, n_items):
+        self.heap = [] # items, ordered as a binary max-heap on their priority
+        self.position = [-1] * n_items # index of each item in self.heap, -1 if not queued
+        self.priority = [0.0] * n_items
+
+    def __len__(self):
+        return len(self.heap)
+
+    def empty(self):
+        return len(self.heap) == 0
+
+    def push(self, item, priority):
+        ''' Queue item with the given priority, or raise its priority if it is queued with a lower one '''
+        i = self.position[item]
+        if i == -1:
+            self.priority[item] = priority
+            self.heap.append(item)
+            self.position[item] = len(self.heap) - 1
+            self._sift_up(len(self.heap) - 1)
+        elif priority > self.priority[item]:
+            self.priority[item] = priority
+            self._sift_up(i)
+
+    def pop(self):
+        ''' Remove and return the item with the highest priority, together with that priority '''
+        top = self.heap[0]
+        last = self.heap.pop()
+        self.position[top] = -1
+        if self.heap:
+            self.heap[0] = last
+            self.position[last] = 0
+            self._sift_down(0)
+        return top, self.priority[top]
+
+    def _sift_up(self, i):
+        heap, position, priority = self.heap, self.position, self.priority
+        item = heap[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if priority[heap[parent]] >= priority[item]:
+                break
+            heap[i] = heap[parent]
+            position[heap[i]] = i
+            i = parent
+        heap[i] = item
+        position[item] = i
+
+    def _sift_down(self, i):
+        heap, position, priority = self.heap, self.position, self.priority
+        item = heap[i]
+        n = len(heap)
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and priority[heap[child + 1]] > priority[heap[child]]:
+                child += 1
+            if priority[heap[child]] <= priority[item]:
+                break
+            heap[i] = heap[child]
+            position[heap[i]] = i
+            i = child
+        heap[i] = item
+        position[item] = i
+
+
+models = {'dense': DenseModel, 'sparse': SparseModel}
+
+def make_model(model, n_states, n_actions, rng=None):
+    ''' Build a model store from its name in models, or return model unchanged if it already is one '''
+    if isinstance(model, str):
+        if model not in models:
+            raise KeyError(f'Model {model} not implemented')
+        return models[model](n_states, n_actions, rng=rng)
+    return model
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MBRLResults.py
+
+On-disk store for the results of MBRL experiment sweeps, so that an
+interrupted sweep can be resumed without re-running finished jobs.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+class ResultsStore:
+    """
+    Keeps the result of every finished (config, repetition) job as a small
+    .npz file in directory, named after a hash of the config. A config is a
+    dict of all settings that influence the result (agent, wind, planning
+    updates, seed, ...), so changing any of them never reuses stale results.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def config_key(config):
+        ''' Short stable hash of a config dict '''
+        encoded = json.dumps(config, sort_keys=True).encode()
+        return hashlib.sha1(encoded).hexdigest()[:16]
+
+    def path(self, config, repetition):
+        return os.path.join(self.directory, f"{self.config_key(config)}_rep{repetition}.npz")
+
+    def contains(self, config, repetition):
+        return os.path.exists(self.path(config, repetition))
+
+    def save(self, config, repetition, times, returns, runtime, profile=None):
+        ''' Store the evaluation times, returns and the wall time (seconds) of one repetition,
+        and optionally a profile (a JSON-serialisable dict, see PhaseProfiler.to_dict).
+        The file is written under a temporary name first, so an interrupted write never
+        leaves a truncated result behind that would be picked up on resume '''
+        path = self.path(config, repetition)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, times=times, returns=returns, runtime=runtime,
+                     config=json.dumps(config, sort_keys=True), profile=json.dumps(profile))
+        os.replace(tmp_path, path)
+
+    def load(self, config, repetition):
+        ''' Returns the stored times, returns and runtime of one repetition '''
+        with np.load(self.path(config, repetition)) as data:
+            return data['times'], data['returns'], float(data['runtime'])
+
+    def load_profile(self, config, repetition):
+        ''' Returns the profile stored with one repetition, or None if it has none '''
+        with np.load(self.path(config, repetition)) as data:
+            return json.loads(str(data['profile'])) if 'profile' in data else None
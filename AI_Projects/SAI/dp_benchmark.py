@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the Dynamic Programming solvers
+Compares sweeps-to-converge and wall time on prison.txt and on larger generated maps
+"""
+
+import os
+import time
+import tempfile
+import numpy as np
+from world import World
+from dynamic_programming import Dynamic_Programming
+
+def generate_map(height, width, n_keys, seed=None):
+    ''' Generates a map of the given size as a list of strings. The map is a grid of pillars ('#' at every
+    even row and column). n_keys keys and their doors are placed on random free cells, the agent '*' in
+    the top left corner and a goal '5' in the bottom right corner. seed is a seed or a np.random.Generator.
+    The doors can cut off the goal (e.g. when they land on both neighbours of the agent), use
+    generate_world for a map on which the goal can be reached '''
+    rng = np.random.default_rng(seed)
+    map_np = np.full((height, width), ' ')
+    map_np[0, :] = map_np[-1, :] = map_np[:, 0] = map_np[:, -1] = '#'
+    map_np[2:-1:2, 2:-1:2] = '#' # pillars
+    map_np[1, 1] = '*'
+    map_np[height - 2, width - 2] = '5'
+    free = np.argwhere(map_np == ' ')
+    cells = free[rng.choice(len(free), size=2 * n_keys, replace=False)]
+    for i in range(n_keys):
+        map_np[tuple(cells[2 * i])] = chr(ord('a') + i) # key
+        map_np[tuple(cells[2 * i + 1])] = chr(ord('A') + i) # door
+    return [''.join(row) for row in map_np]
+
+def load_map(rows):
+    ''' Builds a World from a map given as a list of strings '''
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        f.write('\n'.join(rows))
+    try:
+        return World(f.name, verbose=False)
+    finally:
+        os.remove(f.name)
+
+def generate_world(height, width, n_keys, seed=None, max_tries=100):
+    ''' Builds a World from generate_map, redrawing the layout until a goal is reachable from the start.
+    Moves can be undone and keys are never lost, so every reachable state can then reach the goal and
+    value iteration with gamma = 1 converges '''
+    rng = np.random.default_rng(seed)
+    for _ in range(max_tries):
+        env = load_map(generate_map(height, width, n_keys, rng))
+        if env.terminal_states.any():
+            return env
+    raise ValueError('No {}x{} map with {} keys and a reachable goal in {} tries'.format(height, width, n_keys, max_tries))
+
+def time_solver(solve, repetitions=1):
+    ''' Returns the best wall time of solve() over a number of repetitions '''
+    best = np.inf
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        solve()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def benchmark_value_iteration(envs, gamma=1.0, theta=0.001, max_in_place_states=20000):
+    ''' Runs synchronous (vectorised) and in-place value iteration on each env and prints the sweeps
+    and wall time of both. The in-place variant is skipped on envs with more than max_in_place_states states '''
+    print('{:>12}  {:>8}  {:>10}  {:>6}  {:>10}'.format('map', 'states', 'variant', 'sweeps', 'time (s)'))
+    report = {}
+    for name, env in envs.items():
+        for variant, in_place in [('vectorised', False), ('in-place', True)]:
+            if in_place and env.n_states > max_in_place_states:
+                continue
+            DP = Dynamic_Programming()
+            seconds = time_solver(lambda: DP.value_iteration(env, gamma, theta, in_place=in_place, verbose=False))
+            report[(name, variant)] = (DP.n_sweeps, seconds)
+            print('{:>12}  {:>8}  {:>10}  {:>6}  {:>10.4f}'.format(name, env.n_states, variant, DP.n_sweeps, seconds))
+    return report
+
+def benchmark_Q_value_iteration(envs, gamma=1.0, theta=0.001, max_in_place_states=20000):
+    ''' Runs full-table Q-value iteration in float64 and float32, and the in-place variant, on each env and
+    prints the sweeps, wall time and table size of each. The in-place variant is skipped on envs with more
+    than max_in_place_states states '''
+    print('{:>12}  {:>8}  {:>10}  {:>6}  {:>10}  {:>8}'.format('map', 'states', 'variant', 'sweeps', 'time (s)', 'table MB'))
+    report = {}
+    variants = [('float64', False, np.float64), ('float32', False, np.float32), ('in-place', True, np.float64)]
+    for name, env in envs.items():
+        for variant, in_place, dtype in variants:
+            if in_place and env.n_states > max_in_place_states:
+                continue
+            DP = Dynamic_Programming()
+            seconds = time_solver(lambda: DP.Q_value_iteration(env, gamma, theta, in_place=in_place, dtype=dtype, verbose=False))
+            report[(name, variant)] = (DP.n_sweeps, seconds)
+            print('{:>12}  {:>8}  {:>10}  {:>6}  {:>10.4f}  {:>8.2f}'.format(
+                name, env.n_states, variant, DP.n_sweeps, seconds, DP.Q_sa.nbytes / 2**20))
+    return report
+
+def benchmark_prioritized_sweeping(envs, gamma=1.0, theta=0.001):
+    ''' Compares prioritized sweeping with vectorised value iteration on each env, in number of single-state
+    backups (sweeps x states for value iteration), wall time and the largest difference in the values found '''
+    print('{:>12}  {:>8}  {:>10}  {:>10}  {:>10}  {:>10}  {:>8}'.format(
+        'map', 'states', 'VI backups', 'PS backups', 'VI (s)', 'PS (s)', 'max diff'))
+    report = {}
+    for name, env in envs.items():
+        VI, PS = Dynamic_Programming(), Dynamic_Programming()
+        vi_seconds = time_solver(lambda: VI.value_iteration(env, gamma, theta, verbose=False))
+        ps_seconds = time_solver(lambda: PS.prioritized_sweeping(env, gamma, theta, verbose=False))
+        report[name] = (VI.n_sweeps * env.n_states, PS.n_backups, vi_seconds, ps_seconds)
+        print('{:>12}  {:>8}  {:>10}  {:>10}  {:>10.4f}  {:>10.4f}  {:>8.4f}'.format(
+            name, env.n_states, VI.n_sweeps * env.n_states, PS.n_backups, vi_seconds, ps_seconds,
+            np.max(np.abs(VI.V_s - PS.V_s))))
+    return report
+
+def benchmark_solvers(envs, gamma=1.0, theta=0.001, ks=(5, 20)):
+    ''' Compares value iteration, policy iteration and modified policy iteration with k evaluation sweeps
+    for each k in ks on each env. Prints the improvement steps (iterations), sweeps and wall time of each,
+    to pick the fastest solver per map '''
+    print('{:>12}  {:>8}  {:>10}  {:>10}  {:>6}  {:>10}'.format('map', 'states', 'solver', 'iterations', 'sweeps', 'time (s)'))
+    solvers = [('VI', lambda DP, env: DP.value_iteration(env, gamma, theta, verbose=False)),
+               ('PI', lambda DP, env: DP.policy_iteration(env, gamma, theta, verbose=False))]
+    for k in ks:
+        solvers.append(('MPI k={}'.format(k), lambda DP, env, k=k: DP.modified_policy_iteration(env, gamma, theta, k, verbose=False)))
+    report = {}
+    for name, env in envs.items():
+        for solver, solve in solvers:
+            DP = Dynamic_Programming()
+            seconds = time_solver(lambda: solve(DP, env))
+            iterations = DP.n_iterations if DP.n_iterations is not None else '-'
+            sweeps = DP.n_sweeps if DP.n_sweeps is not None else '-'
+            report[(name, solver)] = (iterations, sweeps, seconds)
+            print('{:>12}  {:>8}  {:>10}  {:>10}  {:>6}  {:>10.4f}'.format(name, env.n_states, solver, iterations, sweeps, seconds))
+    return report
+
+def benchmark_rollouts(envs, gamma=1.0, theta=0.001):
+    ''' Solves each env with value iteration and rolls out the compiled greedy policy from every
+    non-terminal state, printing the path lengths and the wall time of the rollouts '''
+    print('{:>12}  {:>8}  {:>8}  {:>10}  {:>10}  {:>10}'.format('map', 'states', 'reached', 'mean path', 'max path', 'time (s)'))
+    report = {}
+    for name, env in envs.items():
+        DP = Dynamic_Programming()
+        DP.value_iteration(env, gamma, theta, verbose=False)
+        start = time.perf_counter()
+        path_lengths, _, reached = DP.rollout_policy(env, verbose=False)
+        seconds = time.perf_counter() - start
+        report[name] = (path_lengths, seconds)
+        print('{:>12}  {:>8}  {:>8.1%}  {:>10.1f}  {:>10}  {:>10.4f}'.format(name, env.n_states, np.mean(reached),
+            np.mean(path_lengths[reached]), np.max(path_lengths[reached], initial=0), seconds))
+    return report
+
+def benchmark_envs(sizes=((15, 15, 3), (31, 31, 4), (61, 61, 6)), seed=0):
+    ''' prison.txt plus generated maps of the given (height, width, keys) '''
+    envs = {'prison': World(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prison.txt'), verbose=False)}
+    for height, width, n_keys in sizes:
+        envs['{}x{}x{}'.format(height, width, n_keys)] = generate_world(height, width, n_keys, seed)
+    return envs
+
+if __name__ == '__main__':
+    envs = benchmark_envs()
+    benchmark_value_iteration(envs)
+    benchmark_Q_value_iteration(envs)
+    benchmark_prioritized_sweeping(envs)
+    benchmark_solvers(envs)
+    benchmark_rollouts(envs)
@@ -15,64 +15,246 @@ class Dynamic_Programming:
     def __init__(self):
         self.V_s = None # will store a potential value solution table
         self.Q_sa = None # will store a potential action-value solution table
+        self.n_sweeps = None # number of sweeps the last solver needed to converge
+        self.n_backups = None # number of single-state backups the last solver did
+        self.n_iterations = None # number of policy improvement steps the last policy iteration solver did
+        self.gamma = 1.0 # discount factor of the last solved MDP
+        self.policy = None # will store the greedy action index in every state, see compile_policy
+        self.policy_table = None # table ('V' or 'Q') that self.policy was compiled from
         
-    def value_iteration(self,env,gamma = 1.0, theta=0.001):
+    def value_iteration(self,env,gamma = 1.0, theta=0.001, in_place=False, verbose=True):
         ''' Executes value iteration on env. 
         gamma is the discount factor of the MDP
-        theta is the acceptance threshold for convergence '''
+        theta is the acceptance threshold for convergence
+        in_place=False does synchronous sweeps, computing max_a(R + gamma*V[s']) for all states at once
+        from the compiled tables of env. in_place=True updates the states one by one (Gauss-Seidel),
+        which can converge in fewer sweeps but loops over all states and actions in Python.
+        The number of sweeps needed is stored in self.n_sweeps '''
 
-        print("Starting Value Iteration (VI)")
+        if verbose:
+            print("Starting Value Iteration (VI)")
         # initialize value table
         V_s = np.zeros(env.n_states)
+        self.n_sweeps = 0
     
-        ## IMPLEMENT YOUR VALUE ITERATION ALGORITHM HERE
-        #print("You still need to implement value iteration!")
-        delta = np.infty
+        delta = np.inf
         while delta > theta:
-            delta = 0
-            for state in env.states:
-                x = V_s[state]
-                y = -np.infty
-                # update V(s) using the equation for value iteration
-                for action in env.actions:
-                    s_prime, r = env.transition_function(state, action)
-                    temp = r + gamma * V_s[s_prime]
-                    if temp > y:
-                        y = temp
-                V_s[state] = y
-                delta = max(delta, abs(x - y))
-            print('Delta/Error: ', delta) # this print statement is a part of the assignment
+            if in_place:
+                delta = 0
+                for state in env.states:
+                    x = V_s[state]
+                    y = -np.inf
+                    # update V(s) using the equation for value iteration
+                    for action_index in range(env.n_actions):
+                        s_prime, r = env.transition_index(state, action_index)
+                        temp = r + gamma * V_s[s_prime]
+                        if temp > y:
+                            y = temp
+                    V_s[state] = y
+                    delta = max(delta, abs(x - y))
+            else:
+                new_V_s = np.max(env.reward_table + gamma * V_s[env.next_state_table], axis=1)
+                delta = np.max(np.abs(new_V_s - V_s))
+                V_s = new_V_s
+            self.n_sweeps += 1
+            if verbose:
+                print('Delta/Error: ', delta) # this print statement is a part of the assignment
 
         self.V_s = V_s
+        self.gamma = gamma
+        self.compile_policy(env, 'V')
         return
 
-    def Q_value_iteration(self,env,gamma = 1.0, theta=0.001):
+    def Q_value_iteration(self,env,gamma = 1.0, theta=0.001, in_place=False, dtype=np.float64, verbose=True):
         ''' Executes Q-value iteration on env. 
         gamma is the discount factor of the MDP
-        theta is the acceptance threshold for convergence '''
+        theta is the acceptance threshold for convergence
+        in_place=False updates the full table at once, Q = R + gamma*max_a' Q[s',a'], from the compiled tables
+        of env. in_place=True updates the state-action pairs one by one (Gauss-Seidel).
+        dtype=np.float32 halves the memory of the table
+        The number of sweeps needed is stored in self.n_sweeps '''
 
-        print("Starting Q-value Iteration (QI)")
+        if verbose:
+            print("Starting Q-value Iteration (QI)")
         # initialize state-action value table
-        Q_sa = np.zeros([env.n_states,env.n_actions])
+        Q_sa = np.zeros([env.n_states,env.n_actions],dtype=dtype)
+        reward_table = env.reward_table.astype(dtype)
+        self.n_sweeps = 0
 
-        ## IMPLEMENT YOUR Q-VALUE ITERATION ALGORITHM HERE
-        #print("You still need to implement Q-value iteration!")
-        delta = np.infty
+        delta = np.inf
         while delta > theta:
-            delta = 0
-            for state in env.states:
-                for action_index in range(len(env.actions)):
-                    x = Q_sa[state,action_index]
-                    s_prime, r = env.transition_function(state, env.actions[action_index])
-                    # update Q(s,a) using the q-value iteration equation
-                    # over all actions, find max Q(s_prime, action_prime) called y
-                    values = np.array([Q_sa[s_prime, a] for a in range(len(env.actions))])
-                    y = np.max(values)
-                    Q_sa[state, action_index] = r + gamma * y
-                    delta = max(delta, abs(x - Q_sa[state, action_index]))
+            if in_place:
+                delta = 0
+                for state in env.states:
+                    for action_index in range(env.n_actions):
+                        x = Q_sa[state,action_index]
+                        s_prime, r = env.transition_index(state, action_index)
+                        # update Q(s,a) using the q-value iteration equation
+                        Q_sa[state, action_index] = r + gamma * np.max(Q_sa[s_prime])
+                        delta = max(delta, abs(x - Q_sa[state, action_index]))
+            else:
+                new_Q_sa = reward_table + dtype(gamma) * np.max(Q_sa, axis=1)[env.next_state_table]
+                delta = np.max(np.abs(new_Q_sa - Q_sa))
+                Q_sa = new_Q_sa
+            self.n_sweeps += 1
         self.Q_sa = Q_sa
+        self.gamma = gamma
+        self.compile_policy(env, 'Q')
         return
                 
+    def prioritized_sweeping(self,env,gamma = 1.0, theta=0.001, batch_ratio=0.5, verbose=True):
+        ''' Executes prioritized sweeping on env, an asynchronous variant of value iteration.
+        gamma is the discount factor of the MDP
+        theta is the acceptance threshold for convergence
+        The priority of a state is its Bellman error. Every round backs up, as one batch, all states whose
+        error is above batch_ratio times the largest error (and above theta), then recomputes the errors of
+        only their predecessors, gathered at once from the predecessor index. States whose successors no
+        longer change are never touched again. Stops when no state has an error above theta.
+        The number of backups is stored in self.n_backups '''
+
+        if verbose:
+            print("Starting Prioritized Sweeping (PS)")
+        V_s = np.zeros(env.n_states)
+        predecessors, indptr = predecessor_index(env.next_state_table)
+        errors = np.abs(np.max(env.reward_table + gamma * V_s[env.next_state_table], axis=1) - V_s)
+        marked = np.zeros(env.n_states, dtype=bool) # to collect every predecessor once
+        self.n_backups = 0
+
+        while True:
+            max_error = np.max(errors)
+            if max_error <= theta:
+                break
+            batch = np.flatnonzero(errors > max(theta, batch_ratio * max_error))
+            V_s[batch] = np.max(env.reward_table[batch] + gamma * V_s[env.next_state_table[batch]], axis=1)
+            errors[batch] = 0.0
+            self.n_backups += len(batch)
+            # the values of the batch changed, so the Bellman error of their predecessors may have changed
+            marked[gather_predecessors(predecessors, indptr, batch)] = True
+            changed = np.flatnonzero(marked)
+            marked[changed] = False
+            errors[changed] = np.abs(np.max(env.reward_table[changed] + gamma * V_s[env.next_state_table[changed]], axis=1) - V_s[changed])
+        if verbose:
+            print('Converged after {} backups ({:.1f} sweeps worth)'.format(self.n_backups, self.n_backups / env.n_states))
+
+        self.V_s = V_s
+        self.gamma = gamma
+        self.compile_policy(env, 'V')
+        return
+
+    def policy_iteration(self,env,gamma = 1.0, theta=0.001, verbose=True):
+        ''' Executes policy iteration on env.
+        gamma is the discount factor of the MDP
+        theta is only used to evaluate policies that never reach a goal when gamma < 1 (see evaluate_policy)
+        Alternates an exact evaluation of the policy with a greedy improvement, until the policy is stable.
+        It starts from the policy that moves one step closer to a goal in every state (see goal_policy),
+        so every state that can reach a goal has a finite value from the first evaluation on, and with
+        gamma close to 1 it needs far fewer improvement steps than value iteration needs sweeps.
+        The policy only switches actions that are strictly better, so it can not cycle between equally
+        valued actions. The number of improvement steps is stored in self.n_iterations '''
+
+        if verbose:
+            print("Starting Policy Iteration (PI)")
+        states = np.arange(env.n_states)
+        policy = goal_policy(env)
+        self.n_iterations = 0
+        while True:
+            V_s = evaluate_policy(env.next_state_table[states,policy], env.reward_table[states,policy], gamma, theta)
+            Q_sa = env.reward_table + gamma * V_s[env.next_state_table]
+            # keep the current action unless another one is strictly better
+            new_policy = np.where(Q_sa[states,policy] >= np.max(Q_sa,axis=1), policy, np.argmax(Q_sa,axis=1))
+            self.n_iterations += 1
+            n_changed = np.count_nonzero(new_policy != policy)
+            if verbose:
+                print('Iteration {}: {} actions changed'.format(self.n_iterations, n_changed))
+            if n_changed == 0:
+                break
+            policy = new_policy
+
+        self.V_s = V_s
+        self.gamma = gamma
+        self.compile_policy(env, 'V')
+        return
+
+    def modified_policy_iteration(self,env,gamma = 1.0, theta=0.001, k=5, verbose=True):
+        ''' Executes modified policy iteration on env.
+        gamma is the discount factor of the MDP
+        theta is the acceptance threshold for convergence
+        k is the number of evaluation sweeps V = R + gamma*V[s'] of the greedy policy per improvement step,
+        so k = 1 is value iteration and a large k approaches policy iteration.
+        Stops when the Bellman error of the values after an improvement step is at most theta.
+        The number of improvement steps is stored in self.n_iterations, the number of sweeps
+        (evaluation and improvement) in self.n_sweeps '''
+
+        if verbose:
+            print("Starting Modified Policy Iteration (MPI) with k = {}".format(k))
+        states = np.arange(env.n_states)
+        V_s = np.zeros(env.n_states)
+        self.n_iterations = 0
+        self.n_sweeps = 0
+        while True:
+            # greedy improvement
+            Q_sa = env.reward_table + gamma * V_s[env.next_state_table]
+            policy = np.argmax(Q_sa,axis=1)
+            delta = np.max(np.abs(Q_sa[states,policy] - V_s))
+            self.n_iterations += 1
+            self.n_sweeps += 1
+            if verbose:
+                print('Delta/Error: ', delta)
+            if delta <= theta:
+                break
+            # partial evaluation of the greedy policy, starting from the current values
+            next_states, rewards = env.next_state_table[states,policy], env.reward_table[states,policy]
+            for _ in range(k):
+                V_s = rewards + gamma * V_s[next_states]
+            self.n_sweeps += k
+
+        self.V_s = V_s
+        self.gamma = gamma
+        self.compile_policy(env, 'V')
+        return
+
+    def compile_policy(self,env,table='V',tie_breaking='first',rng=None):
+        ''' Compiles the greedy policy of the value table self.V_s (table='V') or the state-action value
+        table self.Q_sa (table='Q') into self.policy, the index of the greedy action in every state.
+        For V the action values are R + gamma*V[s'] with the gamma of the last solver.
+        tie_breaking='first' picks the first of equally valued actions, 'random' a random one (using rng) '''
+        if table == 'V':
+            Q_sa = env.reward_table + self.gamma * self.V_s[env.next_state_table]
+        else:
+            Q_sa = self.Q_sa
+        self.policy = greedy_actions(Q_sa, tie_breaking, rng)
+        self.policy_table = table
+        return self.policy
+
+    def rollout_policy(self,env,start_states=None,max_steps=None,verbose=True):
+        ''' Executes self.policy from many start states at once, without interaction.
+        start_states defaults to all non-terminal states, max_steps to env.n_states (the longest path
+        a policy that reaches a goal can take). Returns the path length and the return from each start
+        state, and whether it reached a goal; the path length is -1 when it did not '''
+        if start_states is None:
+            start_states = env.states[~env.terminal_states]
+        if max_steps is None:
+            max_steps = env.n_states
+        s = np.array(start_states)
+        path_lengths = np.zeros(len(s),dtype=int)
+        returns = np.zeros(len(s))
+        active = np.flatnonzero(~env.terminal_states[s]) # rollouts that have not reached a goal yet
+        for step in range(max_steps):
+            if len(active) == 0:
+                break
+            a = self.policy[s[active]]
+            returns[active] += env.reward_table[s[active],a]
+            s[active] = env.next_state_table[s[active],a]
+            path_lengths[active] += 1
+            active = active[~env.terminal_states[s[active]]]
+        reached = env.terminal_states[s]
+        path_lengths[~reached] = -1
+        if verbose:
+            print('{} of {} rollouts reached a goal, path length mean {:.1f}, max {}'.format(
+                np.count_nonzero(reached), len(s), np.mean(path_lengths[reached]) if np.any(reached) else np.nan,
+                np.max(path_lengths[reached], initial=0)))
+        return path_lengths, returns, reached
+
     def execute_policy(self,env,table='V'):
         ## Execute the greedy action, starting from the initial state
         env.reset_agent()
@@ -81,43 +263,11 @@ class Dynamic_Programming:
         while not env.terminal:
             current_state = env.get_current_state() # this is the current state of the environment, from which you will act
             available_actions = env.actions
-            # Compute action values
-            if table == 'V' and self.V_s is not None:
-                ## IMPLEMENT ACTION VALUE ESTIMATION FROM self.V_s HERE !!!
-                #print("You still need to implement greedy action selection from the value table self.V_s!")
-
-                # out of all possible s_prime from the current state, choose the action that leads to the one with the highest value
-                state_value = -np.infty
-                for action in available_actions:
-                    s_prime, r = env.transition_function(current_state, action)
-                    if r > 0: # final state, in this problem other states have reward -1
-                        best_action = action
-                        state_value = np.infty
-                    elif self.V_s[s_prime] > state_value:
-                        state_value = self.V_s[s_prime]
-                        best_action = action
-
-                greedy_action = best_action
-
-
-            elif table == 'Q' and self.Q_sa is not None:
-                ## IMPLEMENT ACTION VALUE ESTIMATION FROM self.Q_sa here !!!
-                #print("You still need to implement greedy action selection from the state-action value table self.Q_sa!")
-
-                # from the current state choose action for which Q(current state, action) is max
-                state_value = -np.infty
-                for action_index in range(len(available_actions)):
-                    s_prime, r = env.transition_function(current_state, available_actions[action_index])
-                    if r > 0: # final state
-                        best_action = available_actions[action_index]
-                        state_value = np.infty
-                    elif self.Q_sa[current_state, action_index] > state_value:
-                        state_value = self.Q_sa[current_state, action_index]
-                        best_action = available_actions[action_index]
-
-                greedy_action = best_action
-                
-                
+            # Look up the greedy action in the compiled policy
+            if (table == 'V' and self.V_s is not None) or (table == 'Q' and self.Q_sa is not None):
+                if self.policy is None or self.policy_table != table:
+                    self.compile_policy(env, table)
+                greedy_action = available_actions[self.policy[current_state]]
             else:
                 print("No optimal value table was detected. Only manual execution possible.")
                 greedy_action = None
@@ -148,6 +298,81 @@ class Dynamic_Programming:
         print("Found the goal! Exiting \n ...................................................................... ")
     
 
+def predecessor_index(next_state_table):
+    ''' Builds the predecessor index of a deterministic MDP with transition table next_state_table[s,a]
+    in compressed sparse row form: the predecessors of s' are predecessors[indptr[s']:indptr[s'+1]].
+    A state appears once per successor, even if several actions lead there '''
+    n_states, n_actions = next_state_table.shape
+    # unique (s', s) edges encoded as s' * n_states + s, sorted on s'
+    edges = np.sort(next_state_table.astype(np.int64).ravel() * n_states + np.repeat(np.arange(n_states),n_actions))
+    edges = edges[np.concatenate([[True],edges[1:] != edges[:-1]])]
+    indptr = np.concatenate([[0],np.cumsum(np.bincount(edges // n_states,minlength=n_states))])
+    return edges % n_states, indptr
+
+def gather_predecessors(predecessors, indptr, states):
+    ''' The predecessors of all states at once, from their ranges in a predecessor index (see
+    predecessor_index). A state is repeated for every one of the states it is a predecessor of '''
+    lengths = indptr[states+1] - indptr[states]
+    offsets = np.arange(np.sum(lengths)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return predecessors[np.repeat(indptr[states], lengths) + offsets]
+
+def goal_policy(env):
+    ''' The policy that takes, in every state, an action to a successor with the fewest steps to a goal.
+    The steps to a goal are found by a breadth-first search backwards from the goals over the predecessor
+    index. States that can not reach a goal take the first action '''
+    predecessors, indptr = predecessor_index(env.next_state_table)
+    steps = np.full(env.n_states, np.inf)
+    frontier = np.flatnonzero(env.terminal_states)
+    steps[frontier] = 0
+    level = 0
+    while len(frontier) > 0:
+        level += 1
+        new = gather_predecessors(predecessors, indptr, frontier)
+        steps[new[np.isinf(steps[new])]] = level
+        frontier = np.flatnonzero(steps == level)
+    return np.argmin(steps[env.next_state_table],axis=1)
+
+def evaluate_policy(next_states, rewards, gamma = 1.0, theta=0.001):
+    ''' Evaluates a deterministic policy, given the next state next_states[s] and reward rewards[s] of the
+    action it takes in every state. Goals are the absorbing states with reward 0 and have value 0.
+    The states that reach a goal are solved exactly, backwards from the goals, one level of the policy
+    graph at a time. The other states never reach a goal: with gamma = 1 their value is -inf (as every
+    step costs -1), with gamma < 1 they are evaluated iteratively up to theta '''
+    n_states = len(next_states)
+    V_s = np.zeros(n_states)
+    known = (next_states == np.arange(n_states)) & (rewards == 0) # goals
+    # every state has one successor, so sorting the states on their successor gives the predecessor index
+    predecessors = np.argsort(next_states,kind='stable')
+    indptr = np.concatenate([[0],np.cumsum(np.bincount(next_states,minlength=n_states))])
+    frontier = np.flatnonzero(known)
+    while len(frontier) > 0:
+        frontier = gather_predecessors(predecessors, indptr, frontier)
+        frontier = frontier[~known[frontier]]
+        V_s[frontier] = rewards[frontier] + gamma * V_s[next_states[frontier]]
+        known[frontier] = True
+
+    unknown = np.flatnonzero(~known)
+    if gamma < 1:
+        delta = np.inf
+        while delta > theta:
+            new_V_s = rewards[unknown] + gamma * V_s[next_states[unknown]]
+            delta = np.max(np.abs(new_V_s - V_s[unknown]), initial=0.0)
+            V_s[unknown] = new_V_s
+    else:
+        V_s[unknown] = -np.inf
+    return V_s
+
+def greedy_actions(Q_sa, tie_breaking='first', rng=None):
+    ''' Index of the greedy action in every row of Q_sa. tie_breaking='first' picks the first of equally
+    valued actions, 'random' picks one of them uniformly at random, using the generator rng '''
+    if tie_breaking == 'first':
+        return np.argmax(Q_sa,axis=1)
+    elif tie_breaking == 'random':
+        rng = rng if rng is not None else np.random.default_rng()
+        is_max = Q_sa == np.max(Q_sa,axis=1,keepdims=True)
+        return np.argmax(np.where(is_max, rng.random(Q_sa.shape), -1.0),axis=1)
+    raise ValueError('Invalid tie breaking specified: {}'.format(tie_breaking))
+
 def get_greedy_index(action_values):
     ''' Own variant of np.argmax, since np.argmax only returns the first occurence of the max. 
     Optional to uses '''
@@ -8,33 +8,64 @@ By Thomas Moerland
 """
 
 import numpy as np
-import itertools
 
 class World:
 
-    def __init__(self, filename):
-        ''' Initializes a world object '''
-        # read the map from a txt into self.map_np
-        self.map_np,self.dims = read_txt_to_map(filename)
+    def __init__(self, filename, verbose=True, reachable_only=True, dense_index_limit=2**22):
+        ''' Initializes a world object. verbose=False suppresses the prints of the state space and map.
+        reachable_only=True only creates the states that can be reached from the start position,
+        found with a breadth-first search, instead of every free location x every combination of keys.
+        Codes (see below) are mapped to states with a dense lookup array when there are at most
+        dense_index_limit possible codes, and with a binary search in the sorted codes otherwise '''
+        # read the map from a txt into a uint8 grid of characters, with masks of the cell categories
+        self.grid,self.dims = read_txt_to_grid(filename)
+        self.map_np = self.grid.view('S1').astype(str) # character map, used for printing
+        self.is_wall,self.is_door,self.is_key,self.is_goal = get_cell_masks(self.grid)
 
         # Identify state and action space
-        self.state_vector_list, self.number_of_keys = get_unique_states_list(self.map_np) # state list as vector representation
-        self.states = np.arange(0,len(self.state_vector_list),1) # state list as indices
-        self.n_states = len(self.states)
+        self.free_locations, self.number_of_keys = get_free_locations(self.is_wall,self.is_key,verbose)
+        # Every (location, keys) combination has a code, the mixed-radix number (location id, key bits):
+        # location id x 2^keys + key bits, where key 'a' is the most significant bit.
+        # location_ids maps every cell to its id (-1 for walls)
+        self.location_ids = np.full(self.grid.shape,-1,dtype=int)
+        self.location_ids[self.free_locations[:,0],self.free_locations[:,1]] = np.arange(len(self.free_locations))
+        self.key_weights = 2**np.arange(self.number_of_keys-1,-1,-1) # value of each key bit
+        self.n_codes = len(self.free_locations)*2**self.number_of_keys
         self.actions = np.array(['up','down','left','right'])
         self.n_actions = len(self.actions)    
+        self.action_indices = {action:index for index,action in enumerate(self.actions)}
         
         # Set current state
         self.start_state = self.find_start_state(self.number_of_keys)
+        self._compile_cells()
+
+        # A state index is the position of its code in the sorted array self.state_codes
+        start_code = self._encode(self.start_state)
+        dense = self.n_codes <= dense_index_limit
+        self.state_codes = self._reachable_codes(start_code,dense) if reachable_only else np.arange(self.n_codes)
+        self.state_codes = self.state_codes.astype(np.int32 if self.n_codes < 2**31 else np.int64)
+        self.code_to_state = None
+        if dense:
+            self.code_to_state = np.full(self.n_codes,-1,dtype=np.int32)
+            self.code_to_state[self.state_codes] = np.arange(len(self.state_codes))
+        self.states = np.arange(0,len(self.state_codes),1) # state list as indices
+        self.n_states = len(self.states)
+        if verbose and reachable_only:
+            print('{} of these states are reachable from the start'.format(self.n_states))
         self.reset_agent()
 
-        print('Initialization map:')
-        self.print_map()
+        # Compile the MDP into next state and reward tables
+        self._build_transition_tables()
+
+        if verbose:
+            print('Initialization map:')
+            self.print_map()
 
     def find_start_state(self,number_of_keys):
         ''' finds the start state of the agent, indicated by * on the start map '''
-        location = np.array(np.where(self.map_np == '*')).squeeze()
-        self.map_np[location[0],location[1]] = ' ' # remove the agent location from the map
+        location = np.array(np.where(self.grid == ord('*'))).squeeze()
+        self.grid[location[0],location[1]] = ord(' ') # remove the agent location from the map
+        self.map_np[location[0],location[1]] = ' '
         start_state = np.append(location,np.zeros(number_of_keys,dtype='int'))
         return start_state
 
@@ -55,7 +86,7 @@ class World:
         # update the internal state
         self.current_state_vector = self._state_to_state_vector(s_prime)
         # check if we have terminated        
-        if self.map_np[self.current_state_vector[0],self.current_state_vector[1]].isdigit():
+        if self.is_goal[self.current_state_vector[0],self.current_state_vector[1]]:
             self.terminal = True
         return s_prime, r
 
@@ -81,69 +112,113 @@ class World:
         Note that the environment is deterministic, so each (s,a) has only one
         next state s', and the probability of this observation is always 1.
         We therefore do not pass the transition probabilities '''
-        
-        state_vector = self._state_to_state_vector(s)
-        # Current location
-        location = state_vector[0:2] # selects first two elements
-        
-        # First check whether we are at a terminal state:
-        current_location_element = self.map_np[location[0],location[1]]
-        if current_location_element.isdigit():
-            # we are at a goal, return the same state and a reward of 0
-            return s, 0
-        
-        # Move the agent:
-        s_prime = np.copy(state_vector)         
-        new_location = np.copy(location)
-        if a == 'up':
-            new_location[0] -=1 # first coordinate decreases to move up 
-        elif a == 'down':
-            new_location[0] +=1        
-        elif a == 'left':
-            new_location[1] -=1 # second coordinate decreases to move left         
-        elif a == 'right':
-            new_location[1] +=1        
-        else:
+        if a not in self.action_indices:
             raise ValueError('Invalid action specified: {}'.format(a))
-        
-        # check whether the new location is valid:
-        new_location_element = self.map_np[new_location[0],new_location[1]]
-        if new_location_element == '#':
-            # cannot move there
-            new_location = location
-        elif new_location_element.isupper():
-            # stepped onto a door, check whether we can open it:
-            index = value_of_capital_letter(new_location_element) # index of door
-            if not state_vector[index+1]:
-                # We don't have the key, cannot move there
-                new_location = location     
-
-        # update the location in the state:
-        s_prime[0:2] = new_location
-        
-        # check whether we pick up a key:
-        if new_location_element.islower():
-            index = value_of_lower_letter(new_location_element) # index of key
-            s_prime[index+1] = True # We now have this key
-
-        # Check the reward:
-        if new_location_element.isdigit():
-            # Found the goal
-            r = int(new_location_element)*10
+        return self.transition_index(s,self.action_indices[a])
+
+    def transition_index(self,s,a_index):
+        ''' Same as transition_function, with the action given by its index in self.actions '''
+        return int(self.next_state_table[s,a_index]), int(self.reward_table[s,a_index])
+
+    def action_index(self,a):
+        ''' returns the index of action a (a string) in self.actions '''
+        return self.action_indices[a]
+
+    def _compile_cells(self):
+        ''' Stores the per-cell properties of the map that the dynamics depend on, computed from the grid masks '''
+        grid = self.grid.astype(int)
+        self.step_reward = np.full(grid.shape,-1,dtype=int) # reward for stepping onto a cell
+        self.step_reward[self.is_goal] = (grid[self.is_goal] - ord('0'))*10 # found the goal
+        self.key_bit = np.zeros(grid.shape,dtype=int) # bit of the key on a cell, 0 if no key
+        self.key_bit[self.is_key] = self.key_weights[grid[self.is_key] - ord('a')]
+        self.door_bit = np.zeros(grid.shape,dtype=int) # bit of the key that opens a door, 0 if no door
+        self.door_bit[self.is_door] = self.key_weights[grid[self.is_door] - ord('A')]
+
+    def _transitions(self,codes):
+        ''' Computes the next codes and rewards of all actions for an array of codes, returned as two
+        (len(codes),n_actions) arrays: walls and locked doors block the move, stepping on a key picks it up,
+        stepping on a goal gives 10x its digit as reward (otherwise -1), and goals are absorbing with reward 0 '''
+        key_modulus = 2**self.number_of_keys
+        location_id, key_bits = np.divmod(codes,key_modulus)
+        location = self.free_locations[location_id]
+        moves = np.array([[-1,0],[1,0],[0,-1],[0,1]]) # up, down, left, right
+        next_codes = np.zeros((len(codes),self.n_actions),dtype=int)
+        rewards = np.zeros((len(codes),self.n_actions),dtype=int)
+        for a_index,move in enumerate(moves):
+            new_location = location + move
+            row,col = new_location.T.copy() # the cell the agent tries to step onto
+            # walls and doors without their key block the move
+            blocked = self.is_wall[row,col] | ((self.door_bit[row,col] & key_bits) != self.door_bit[row,col])
+            new_location[blocked] = location[blocked]
+            new_key_bits = key_bits | self.key_bit[row,col]
+            next_codes[:,a_index] = self.location_ids[new_location[:,0],new_location[:,1]] * key_modulus + new_key_bits
+            rewards[:,a_index] = self.step_reward[row,col]
+        # goals are absorbing
+        at_goal = self.is_goal[location[:,0],location[:,1]]
+        next_codes[at_goal] = np.asarray(codes)[at_goal,None]
+        rewards[at_goal] = 0
+        return next_codes, rewards
+
+    def _reachable_codes(self,start_code,dense=True):
+        ''' Breadth-first search from start_code, expanding a whole frontier at once.
+        dense=True marks visited codes in a boolean array over all codes, otherwise the
+        visited codes are kept as a sorted array. Returns the sorted array of all reachable codes '''
+        if dense:
+            visited = np.zeros(self.n_codes,dtype=bool)
+            visited[start_code] = True
         else:
-            # every step a small penalty
-            r = -1
+            visited = np.array([start_code])
+        frontier = np.array([start_code])
+        while len(frontier) > 0:
+            next_codes, _ = self._transitions(frontier)
+            if dense:
+                frontier = np.unique(next_codes[~visited[next_codes]]) # codes that were not visited yet
+                visited[frontier] = True
+            else:
+                frontier = np.setdiff1d(next_codes,visited)
+                visited = np.union1d(visited,frontier)
+        return np.flatnonzero(visited) if dense else visited
 
-        return self._state_vector_to_state(s_prime),r
+    def _build_transition_tables(self):
+        ''' Compiles the whole MDP into next_state_table[s,a] and reward_table[s,a], computed for all states at once '''
+        next_codes, self.reward_table = self._transitions(self.state_codes)
+        self.next_state_table = self._code_to_state(next_codes)
+        # states in which the agent is at a goal
+        location = self.free_locations[self.state_codes // 2**self.number_of_keys]
+        self.terminal_states = self.is_goal[location[:,0],location[:,1]]
+
+    def _encode(self,state_vector):
+        ''' returns the code of a state vector [row, column, key_1, ..., key_n] '''
+        location_id = self.location_ids[state_vector[0],state_vector[1]]
+        return location_id * 2**self.number_of_keys + int(np.dot(state_vector[2:],self.key_weights))
+
+    def _code_to_state(self,code,state_vector=None):
+        ''' returns the state index of a code, or of an array of codes.
+        Raises a ValueError if a code is not one of the states, e.g. because it is not reachable
+        from the start. state_vector is only used to name the state in the error message '''
+        code = np.asarray(code)
+        valid = (code >= 0) & (code < self.n_codes)
+        if self.code_to_state is not None:
+            state = np.where(valid,self.code_to_state[np.where(valid,code,0)],-1).astype(int)
+            valid &= state >= 0
+        else:
+            state = np.searchsorted(self.state_codes,code)
+            in_range = state < len(self.state_codes)
+            valid &= in_range & (self.state_codes[np.where(in_range,state,0)] == code)
+        if not np.all(valid):
+            name = state_vector if state_vector is not None else code[~valid]
+            raise ValueError('No state for {}: it is not a free location or not reachable from the start'.format(name))
+        return state
 
     def _state_vector_to_state(self,state_vector):
-        ''' given a state vector, returns the state, i.e., 
-        the index in self.state_vector_list that matches state_vector'''
-        return np.where(np.all(state_vector == self.state_vector_list,axis=1))[0][0]
+        ''' given a state vector [row, column, key_1, ..., key_n], returns the state index '''
+        return int(self._code_to_state(self._encode(state_vector),state_vector))
 
     def _state_to_state_vector(self,state):
         ''' returns the underlying state vector for a state index '''
-        return self.state_vector_list[state]
+        location_id, key_bits = divmod(int(self.state_codes[state]),2**self.number_of_keys)
+        keys = (key_bits // self.key_weights) % 2
+        return np.concatenate([self.free_locations[location_id],keys])
 
 ### Helper functions for indices to letters                
 def value_of_capital_letter(letter):
@@ -160,50 +235,45 @@ def index_to_character(index):
 
 ### Helper functions for initialization of world
     
-def read_txt_to_map(filename):
-    # Reads a txt file of the world to a numpy map 
-    with open(filename) as f:
-        txt = [line.rstrip() for line in f]   
+def read_txt_to_grid(filename):
+    # Reads a txt file of the world in one pass to a uint8 grid of character codes
+    # All lines must be as wide as the first one, otherwise a ValueError is raised
+    with open(filename,'rb') as f:
+        txt = [line.rstrip() for line in f.read().splitlines()]
+    while txt and not txt[-1]:
+        txt.pop() # ignore empty lines at the end of the file
     dims = [len(txt),len(txt[0])]
-    map_np = np.empty(dims,dtype="<U1").astype('str')
-    for i in range(dims[0]):
-        for j in range (dims[1]):
-            map_np[i,j] = txt[i][j]
-    return map_np,dims
-
-def get_unique_states_list(map_np):
-    ## Generates a list of unique states in the map
-    # Count all free_locations and the number of keys
-    dims = map_np.shape
-    free_locations = []
-    number_of_keys = 0
-    for i in range(dims[0]):
-        for j in range (dims[1]):
-            if map_np[i,j] != '#':
-                free_locations.append([i,j]) # store all free locations
-            if map_np[i,j].islower():
-                number_of_keys += 1 # counted a key
-    free_locations = np.array(free_locations)
+    for i,line in enumerate(txt):
+        if len(line) != dims[1]:
+            raise ValueError('Line {} of {} has {} characters, expected {} like the first line'.format(
+                i+1,filename,len(line),dims[1]))
+    grid = np.frombuffer(b''.join(txt),dtype=np.uint8)
+    return grid.reshape(dims).copy(),dims
+
+def read_txt_to_map(filename):
+    # Reads a txt file of the world to a numpy map of characters
+    grid,dims = read_txt_to_grid(filename)
+    return grid.view('S1').astype(str),dims
+
+def get_cell_masks(grid):
+    ## Masks of the walls, doors, keys and goals in a uint8 grid
+    is_wall = grid == ord('#')
+    is_door = (grid >= ord('A')) & (grid <= ord('Z'))
+    is_key = (grid >= ord('a')) & (grid <= ord('z'))
+    is_goal = (grid >= ord('0')) & (grid <= ord('9'))
+    return is_wall,is_door,is_key,is_goal
+
+def get_free_locations(is_wall,is_key,verbose=True):
+    ## Finds all free locations in the map and the number of keys
+    free_locations = np.argwhere(~is_wall) # in row-major order
+    number_of_keys = int(np.count_nonzero(is_key))
     
-    # Make all unique combinations of having/not having the keys
-    if number_of_keys > 0:
-        possible_key_combinations = np.array(list(itertools.product([0, 1], repeat=number_of_keys)))
-    else:
-        possible_key_combinations = None
-
-    # Make a list of all possible unique states. Each state is a combination of a
-    # free location and a possible combination of keys. The total number of states
-    # equals 'number of free locations' x (2)^'number_of_keys'
-    unique_states = []
-    for free_location in free_locations:
-        if possible_key_combinations is not None:
-            for key_combination in possible_key_combinations:                
-                unique_states.append(np.concatenate([free_location,key_combination],0))
-        else:
-            unique_states.append(free_location)
-    print('Identified {} free locations and {} keys, leading to {} unique states'.format(
-            len(free_locations),number_of_keys,len(unique_states)))
-    return unique_states, number_of_keys
+    # Every state is a combination of a free location and a possible combination of keys.
+    # The total number of states equals 'number of free locations' x (2)^'number_of_keys'
+    if verbose:
+        print('Identified {} free locations and {} keys, leading to {} unique states'.format(
+                len(free_locations),number_of_keys,len(free_locations)*2**number_of_keys))
+    return free_locations, number_of_keys
 
 if __name__ == '__main__':
     env = World('prison.txt') 
@@ -212,8 +282,8 @@ if __name__ == '__main__':
     env.print_state(test_state)
 
     print('---- Small tests of keys and door dynamics ----')
-    test_state1 = env._state_vector_to_state(np.array([1,2,False,False]))
-    test_state2 = env._state_vector_to_state(np.array([1,2,True,False]))
+    test_state1 = env._state_vector_to_state(np.array([1,2,False,False,False]))
+    test_state2 = env._state_vector_to_state(np.array([1,2,True,False,False]))
     env.print_state(test_state1)
     env.print_state(test_state2)
     s_prime1,r1 = env.transition_function(test_state1,'right')    